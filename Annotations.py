@@ -0,0 +1,11 @@
+import cv2
+
+
+def draw_annotations(frame, annotations):
+    """Draw the box and label of every DET annotation (box_cx, box_cy, box_w, box_h, label) on the frame."""
+    for annotation in annotations:
+        x0 = int(annotation["box_cx"] - annotation["box_w"] / 2)
+        y0 = int(annotation["box_cy"] - annotation["box_h"] / 2)
+        x1, y1 = int(x0 + annotation["box_w"]), int(y0 + annotation["box_h"])
+        cv2.rectangle(frame, (x0, y0), (x1, y1), (0, 255, 0), 2)
+        cv2.putText(frame, str(annotation["label"]), (x0, y0 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
@@ -0,0 +1,105 @@
+import os
+import glob
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from ResultsSink import JsonLinesSink
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+MANIFEST_EXTENSIONS = ('.txt', '.lst')
+
+
+def is_batch_input(spec):
+    """A directory, a glob pattern or a manifest file (one image path per line) means batch mode."""
+    return os.path.isdir(spec) or glob.has_magic(spec) or spec.lower().endswith(MANIFEST_EXTENSIONS)
+
+
+def expand_inputs(spec):
+    """List the image paths a batch input spec refers to, in a stable order."""
+    if os.path.isdir(spec):
+        paths = []
+        for root, _, files in os.walk(spec):
+            paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+        return sorted(paths)
+    if glob.has_magic(spec):
+        # Like the directory walk, only image files; a pattern like * also matches results and manifests
+        return sorted(path for path in glob.glob(spec, recursive=True)
+                      if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS))
+    # Manifest: relative paths are taken relative to the manifest itself
+    base = os.path.dirname(spec)
+    with open(spec) as manifest:
+        lines = [line.strip() for line in manifest]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+
+
+def prefetch_images(paths, workers=4, lookahead=16):
+    """Yield (path, image) in order while the next images are read and decoded on worker threads."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        paths = iter(paths)
+        for path in paths:
+            pending.append((path, pool.submit(cv2.imread, path)))
+            if len(pending) >= lookahead:
+                break
+        # Keep lookahead reads in flight, topping up one for every image handed out
+        while pending:
+            path, future = pending.popleft()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, pool.submit(cv2.imread, next_path)))
+            yield path, future.result()
+
+
+def output_paths(paths, output_dir):
+    """Output path of every input, keeping its folders below the inputs' common folder so same-named files don't collide."""
+    if not paths:
+        return []
+    folders = [os.path.dirname(os.path.abspath(path)) for path in paths]
+    root = os.path.commonpath(folders)
+    return [os.path.join(output_dir, os.path.relpath(os.path.abspath(path), root)) for path in paths]
+
+
+def write_image(path, image):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return cv2.imwrite(path, image)
+
+
+def run_batch(spec, process, output_dir=None, workers=4, save_images=True, max_pending_writes=None):
+    """Stream every image of a batch input through one warm model.
+
+    process(image) draws on the image and returns the JSON serializable
+    results for it. Results of all images go to one results.jsonl in
+    output_dir (the working directory if not given), annotated images are
+    written below it, in the inputs' folder layout, by a small pool so
+    encoding overlaps with inference. At most max_pending_writes images
+    (2 per writer by default) wait for encoding before processing waits too.
+    """
+    paths = expand_inputs(spec)
+    output_dir = output_dir or '.'
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = dict(zip(paths, output_paths(paths, output_dir)))
+    max_pending_writes = max_pending_writes or 2 * workers
+    processed = 0
+    with JsonLinesSink(os.path.join(output_dir, 'results.jsonl')) as sink, \
+            ThreadPoolExecutor(max_workers=workers) as writers:
+        pending = deque()
+        for path, image in prefetch_images(paths, workers):
+            if image is None:
+                sink.write({"input": path, "error": "could not read image"})
+                continue
+            try:
+                record = {"input": path, "outputs": process(image)}
+            except Exception as e:
+                # A model failing on one odd image must not end the whole batch
+                sink.write({"input": path, "error": str(e)})
+                continue
+            if save_images:
+                record["output"] = outputs[path]
+                pending.append(writers.submit(write_image, outputs[path], image))
+                while len(pending) > max_pending_writes:
+                    pending.popleft().result()
+            sink.write(record)
+            processed += 1
+    print(json.dumps({"images": len(paths), "processed": processed, "results": os.path.join(output_dir, 'results.jsonl')}))
+    return processed
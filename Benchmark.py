@@ -0,0 +1,199 @@
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+import datetime
+import cv2
+import numpy as np
+from StageTimer import StageTimer
+from ModelRegistry import ModelRegistry, MODEL_LOADERS, to_bgr
+
+DEFAULT_RESOLUTIONS = '640x480,1280x720,1920x1080'
+
+
+def synthetic_frame(width, height, seed=0):
+    """A repeatable frame with some gradients, shapes and text so detectors do representative work."""
+    rng = np.random.default_rng(seed)
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    frame[...] = np.linspace(40, 200, width, dtype=np.uint8)[None, :, None]
+    frame += rng.integers(0, 20, size=frame.shape, dtype=np.uint8)
+    cv2.rectangle(frame, (width // 8, height // 8), (width // 3, height // 3), (30, 160, 220), -1)
+    cv2.circle(frame, (width * 2 // 3, height // 2), min(width, height) // 6, (200, 180, 150), -1)
+    cv2.putText(frame, 'TM-ROBOT 0123', (width // 10, height * 3 // 4), cv2.FONT_HERSHEY_SIMPLEX,
+                width / 640.0, (0, 0, 0), 2, cv2.LINE_AA)
+    return frame
+
+
+def recorded_frames(source, limit):
+    """Read up to limit frames from a video file, or from the images of a directory/glob/manifest."""
+    from BatchInput import is_batch_input, expand_inputs
+    frames = []
+    if is_batch_input(source):
+        for path in expand_inputs(source)[:limit]:
+            image = cv2.imread(path)
+            if image is not None:
+                frames.append(image)
+    else:
+        cap = cv2.VideoCapture(source)
+        while len(frames) < limit:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    return frames
+
+
+def bench_detector(model, frames, iterations, warmup):
+    """Time every stage of one robot cycle: decode upload, color convert, inference, drawing, encode, JSON."""
+    timer = StageTimer()
+    uploads = [cv2.imencode('.jpg', frame)[1] for frame in frames]
+    for i in range(warmup):
+        model.infer(frames[i % len(frames)])
+    start = time.perf_counter()
+    for i in range(iterations):
+        upload = uploads[i % len(uploads)]
+        with timer.stage('decode'):
+            frame = cv2.imdecode(upload, cv2.IMREAD_UNCHANGED)
+        with timer.stage('color_convert'):
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        # Inference includes the model's own preprocessing (e.g. the RGB conversion MediaPipe needs)
+        with timer.stage('inference'):
+            annotations = model.infer(to_bgr(frame))
+        with timer.stage('drawing'):
+            model.draw(frame, annotations)
+        with timer.stage('encode'):
+            cv2.imencode('.jpg', frame)
+        with timer.stage('json'):
+            json.dumps({"message": "success", "annotations": annotations})
+    elapsed = time.perf_counter() - start
+    return timer.summary(), iterations / elapsed
+
+
+def bench_server(registry, model_id, frames, iterations, warmup):
+    """Drive /api/DET end to end through Flask's test client, without the network or the archive."""
+    import TMvision_HTTP_server as server
+    server.registry = server.inference = registry
+    # No archiver (so no writer thread per call), and no per-request log lines on stdout while timing
+    previous_archiver, previous_level = server.archiver, server.logger.level
+    server.archiver = None
+    server.logger.setLevel(logging.WARNING)
+    client = server.app.test_client()
+    uploads = [cv2.imencode('.jpg', frame)[1].tobytes() for frame in frames]
+    timer = StageTimer()
+
+    def post(upload):
+        response = client.post(f'/api/DET?model_id={model_id}', data={'file': (io.BytesIO(upload), 'frame.jpg')},
+                               content_type='multipart/form-data')
+        # A failing request is much cheaper than a real one and would make the server look fast
+        if response.json is None or response.json.get('message') != 'success':
+            raise RuntimeError(f"/api/DET for '{model_id}' failed: {response.status_code} {response.get_data(as_text=True)[:200]}")
+        return response
+
+    try:
+        for i in range(warmup):
+            post(uploads[i % len(uploads)])
+        start = time.perf_counter()
+        for i in range(iterations):
+            with timer.stage('request'):
+                post(uploads[i % len(uploads)])
+        elapsed = time.perf_counter() - start
+    finally:
+        server.archiver = previous_archiver
+        server.logger.setLevel(previous_level)
+    return timer.summary(), iterations / elapsed
+
+
+def version_label():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or 'unknown'
+    except (OSError, subprocess.SubprocessError):
+        return 'unknown'
+
+
+def compare(current, baseline_path):
+    """Print the p50 change of every stage against a previous results file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r["detector"], r["resolution"]): r for r in baseline["results"]}
+    for result in current["results"]:
+        old = previous.get((result["detector"], result["resolution"]))
+        if old is None or "stages" not in old or "stages" not in result:
+            continue
+        for stage, summary in result["stages"].items():
+            old_summary = old["stages"].get(stage)
+            if not old_summary or not old_summary.get("p50_ms"):
+                continue
+            change = (summary["p50_ms"] / old_summary["p50_ms"] - 1.0) * 100.0
+            print(f'{result["detector"]:>10} {result["resolution"]:>10} {stage:>14}: '
+                  f'{old_summary["p50_ms"]:9.3f} -> {summary["p50_ms"]:9.3f} ms p50 ({change:+.1f}%)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the TM vision detectors and HTTP server')
+    parser.add_argument('-d', '--detectors', default=','.join(MODEL_LOADERS),
+                        help='Comma separated model_ids to benchmark')
+    parser.add_argument('-r', '--resolutions', default=DEFAULT_RESOLUTIONS, help='Comma separated WIDTHxHEIGHT list')
+    parser.add_argument('-i', '--input', help='Recorded video, directory, glob or manifest to use instead of synthetic frames')
+    parser.add_argument('-f', '--frames', type=int, default=8, help='Distinct frames per resolution')
+    parser.add_argument('-n', '--iterations', type=int, default=50, help='Timed iterations per detector and resolution')
+    parser.add_argument('-w', '--warmup', type=int, default=3, help='Untimed iterations before measuring')
+    parser.add_argument('-s', '--server', action='store_true', help='Also benchmark /api/DET through the Flask app')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='Where to save the machine readable results')
+    parser.add_argument('-c', '--compare', help='Previous results file to compare against')
+    parser.add_argument('-l', '--label', help='Version label stored with the results (defaults to git describe)')
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry()
+    source_frames = recorded_frames(args.input, args.frames) if args.input else None
+    resolutions = [tuple(int(v) for v in r.split('x')) for r in args.resolutions.split(',') if r]
+
+    report = {
+        "label": args.label or version_label(),
+        "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+        "platform": {"python": platform.python_version(), "machine": platform.machine(),
+                     "processor": platform.processor(), "cpus": os.cpu_count(), "opencv": cv2.__version__},
+        "results": [],
+    }
+
+    for model_id in [m for m in args.detectors.split(',') if m]:
+        start = time.perf_counter()
+        try:
+            model = registry.get(model_id)
+        except ImportError as e:
+            print(f'{model_id}: skipped, {e}')
+            report["results"].append({"detector": model_id, "resolution": None, "skipped": str(e)})
+            continue
+        load_seconds = time.perf_counter() - start
+        print(f'{model_id}: model load {load_seconds:.2f} s')
+
+        for width, height in resolutions:
+            if source_frames:
+                frames = [cv2.resize(frame, (width, height)) for frame in source_frames]
+            else:
+                frames = [synthetic_frame(width, height, seed) for seed in range(args.frames)]
+            stages, fps = bench_detector(model, frames, args.iterations, args.warmup)
+            result = {"detector": model_id, "resolution": f'{width}x{height}', "model_load_s": round(load_seconds, 3),
+                      "fps": round(fps, 2), "stages": stages}
+            if args.server:
+                server_stages, server_fps = bench_server(registry, model_id, frames, args.iterations, args.warmup)
+                result["server"] = {"fps": round(server_fps, 2), "stages": server_stages}
+            report["results"].append(result)
+            print(f'{model_id:>10} {width}x{height}: {fps:7.2f} fps, inference p50 {stages["inference"]["p50_ms"]:.2f} ms'
+                  f' p99 {stages["inference"]["p99_ms"]:.2f} ms')
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f'Results saved to {args.output}')
+    if args.compare:
+        compare(report, args.compare)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import argparse
+import json
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+# Every message in either direction is a 4-byte big-endian length followed by that many bytes.
+#
+# Request:  request_id u32 | method u8 | flags u8 | model_id length u8 | model_id | image
+#           image is an encoded JPEG/PNG, or with FLAG_RAW: height u16 | width u16 | channels u8 | uint8 pixels
+# Response: request_id u32 | status u8 | encoding u8 | payload
+#           payload is the same JSON document /api/CLS and /api/DET return, or with ENCODING_COMPACT:
+#           CLS: score f32 | label
+#           DET: count u16, then per annotation box_cx, box_cy, box_w, box_h, rotation, score as f32 | label
+#           where label is length u16 | utf-8 bytes
+#
+# A connection may send any number of requests without waiting; responses come back in request order.
+LENGTH = struct.Struct('!I')
+REQUEST_HEADER = struct.Struct('!IBBB')
+RAW_SHAPE = struct.Struct('!HHB')
+RESPONSE_HEADER = struct.Struct('!IBB')
+COUNT = struct.Struct('!H')
+ANNOTATION = struct.Struct('!6f')
+SCORE = struct.Struct('!f')
+
+METHODS = ('CLS', 'DET')
+FLAG_RAW = 1
+FLAG_COMPACT = 2
+STATUS_SUCCESS = 0
+STATUS_FAIL = 1
+ENCODING_JSON = 0
+ENCODING_COMPACT = 1
+
+# Larger messages close the connection rather than being buffered
+MAX_MESSAGE = 64 << 20
+
+
+def pack_label(label):
+    data = str(label).encode('utf-8')[:0xFFFF]
+    return COUNT.pack(len(data)) + data
+
+
+def unpack_label(payload, offset):
+    (length,) = COUNT.unpack_from(payload, offset)
+    offset += COUNT.size
+    return bytes(payload[offset:offset + length]).decode('utf-8'), offset + length
+
+
+def encode_compact(m_method, response):
+    if m_method == 'CLS':
+        return SCORE.pack(response["score"]) + pack_label(response["result"])
+    parts = [COUNT.pack(len(response["annotations"]))]
+    for annotation in response["annotations"]:
+        parts.append(ANNOTATION.pack(annotation["box_cx"], annotation["box_cy"], annotation["box_w"], annotation["box_h"],
+                                     annotation.get("rotation", 0.0), annotation.get("score", 0.0)))
+        parts.append(pack_label(annotation["label"]))
+    return b''.join(parts)
+
+
+def decode_compact(m_method, payload):
+    """Rebuild the JSON response from the compact encoding (extra fields such as OCR's Number are not carried)."""
+    if m_method == 'CLS':
+        (score,) = SCORE.unpack_from(payload, 0)
+        label, _ = unpack_label(payload, SCORE.size)
+        return {"message": "success", "result": label, "score": round(score, 3)}
+    (count,) = COUNT.unpack_from(payload, 0)
+    offset = COUNT.size
+    annotations = []
+    for _ in range(count):
+        box_cx, box_cy, box_w, box_h, rotation, score = ANNOTATION.unpack_from(payload, offset)
+        label, offset = unpack_label(payload, offset + ANNOTATION.size)
+        annotations.append({"box_cx": box_cx, "box_cy": box_cy, "box_w": box_w, "box_h": box_h,
+                            "label": label, "score": round(score, 3), "rotation": round(rotation, 2)})
+    return {"message": "success", "annotations": annotations}
+
+
+def read_message(stream):
+    """Read one length-prefixed message from a buffered stream, None at end of stream."""
+    header = stream.read(LENGTH.size)
+    if len(header) < LENGTH.size:
+        return None
+    (length,) = LENGTH.unpack(header)
+    if length > MAX_MESSAGE:
+        raise ValueError(f'message of {length} bytes exceeds the {MAX_MESSAGE} byte limit')
+    body = stream.read(length)
+    if len(body) < length:
+        return None
+    return body
+
+
+def parse_request(body):
+    """Split a request into (request_id, method, flags, model_id, image)."""
+    request_id, method, flags, id_length = REQUEST_HEADER.unpack_from(body, 0)
+    offset = REQUEST_HEADER.size
+    model_id = body[offset:offset + id_length].decode('utf-8')
+    offset += id_length
+    m_method = METHODS[method] if method < len(METHODS) else str(method)
+    if flags & FLAG_RAW:
+        height, width, channels = RAW_SHAPE.unpack_from(body, offset)
+        offset += RAW_SHAPE.size
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        # Wraps the received bytes without copying
+        image = np.frombuffer(body, np.uint8, count=height * width * channels, offset=offset).reshape(shape)
+    else:
+        image = cv2.imdecode(np.frombuffer(body, np.uint8, offset=offset), cv2.IMREAD_UNCHANGED)
+    return request_id, m_method, flags, model_id, image
+
+
+class BinaryRequestHandler(socketserver.StreamRequestHandler):
+    """One connection: this thread reads requests, a writer thread answers them in order as they finish."""
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        # Bounded so a client that never reads its answers stops being read from
+        pending = queue.Queue(maxsize=self.server.max_pipeline)
+        writer = threading.Thread(target=self.write_responses, args=(pending,), daemon=True)
+        writer.start()
+        try:
+            while True:
+                body = read_message(self.rfile)
+                if body is None:
+                    break
+                pending.put(self.server.executor.submit(self.answer, body))
+        except (OSError, ValueError) as e:
+            self.server.log(f'Binary connection {self.client_address} closed: {e}')
+        finally:
+            pending.put(None)
+            writer.join()
+
+    def answer(self, body):
+        request_id = 0
+        try:
+            request_id, m_method, flags, model_id, image = parse_request(body)
+            if image is None:
+                response = {"message": "fail", "result": "image could not be decoded"}
+            else:
+                response = self.server.handle(m_method, model_id, image)
+        except Exception as e:
+            m_method, flags = None, 0
+            response = {"message": "fail", "result": f'malformed request: {e}'}
+        if response.get("message") != "success":
+            return RESPONSE_HEADER.pack(request_id, STATUS_FAIL, ENCODING_JSON) + json.dumps(response).encode('utf-8')
+        if flags & FLAG_COMPACT:
+            return RESPONSE_HEADER.pack(request_id, STATUS_SUCCESS, ENCODING_COMPACT) + encode_compact(m_method, response)
+        return RESPONSE_HEADER.pack(request_id, STATUS_SUCCESS, ENCODING_JSON) + json.dumps(response).encode('utf-8')
+
+    def write_responses(self, pending):
+        broken = False
+        while True:
+            future = pending.get()
+            if future is None:
+                return
+            message = future.result()
+            if broken:
+                continue
+            try:
+                self.connection.sendall(LENGTH.pack(len(message)) + message)
+            except OSError:
+                # Keep draining so the reader never blocks on a full queue
+                broken = True
+
+
+class BinaryServer(socketserver.ThreadingTCPServer):
+    """Length-prefixed TCP listener answering CLS/DET requests next to the HTTP API.
+
+    handle(m_method, model_id, image) returns the same response dict as the HTTP
+    routes; requests from every connection run on a shared pool of worker threads
+    so pipelined requests reach the InferenceScheduler concurrently.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handle, workers=8, max_pipeline=64, log=print):
+        super().__init__(address, BinaryRequestHandler)
+        self.handle = handle
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='binary')
+        self.max_pipeline = max_pipeline
+        self.log = log
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='binary-server', daemon=True)
+        thread.start()
+        return thread
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+class VisionClient:
+    """Client for BinaryServer; request() for one call, send()/receive() to pipeline several.
+
+        client = VisionClient('127.0.0.1', 4586)
+        client.request('DET', 'gesture', frame)            # raw pixels, JSON answer
+        client.request('CLS', 'qr', jpeg_bytes, compact=True)
+    """
+    def __init__(self, host='127.0.0.1', port=4586, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stream = self.sock.makefile('rb')
+        self.next_id = 0
+        # request_id -> method, to decode compact answers
+        self.methods = {}
+
+    def send(self, m_method, model_id, image, compact=False):
+        """Send a request without waiting. image is a BGR/gray uint8 array (sent raw) or encoded JPEG/PNG bytes."""
+        self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+        flags = FLAG_COMPACT if compact else 0
+        model = model_id.encode('utf-8')
+        if isinstance(image, np.ndarray):
+            flags |= FLAG_RAW
+            channels = 1 if image.ndim == 2 else image.shape[2]
+            payload = RAW_SHAPE.pack(image.shape[0], image.shape[1], channels) + np.ascontiguousarray(image, np.uint8).tobytes()
+        else:
+            payload = bytes(image)
+        header = REQUEST_HEADER.pack(self.next_id, METHODS.index(m_method), flags, len(model)) + model
+        self.sock.sendall(LENGTH.pack(len(header) + len(payload)) + header + payload)
+        self.methods[self.next_id] = m_method
+        return self.next_id
+
+    def receive(self):
+        """Wait for the next answer and return (request_id, response dict)."""
+        body = read_message(self.stream)
+        if body is None:
+            raise ConnectionError('server closed the connection')
+        request_id, status, encoding = RESPONSE_HEADER.unpack_from(body, 0)
+        m_method = self.methods.pop(request_id, None)
+        payload = memoryview(body)[RESPONSE_HEADER.size:]
+        if encoding == ENCODING_COMPACT:
+            return request_id, decode_compact(m_method, payload)
+        return request_id, json.loads(bytes(payload))
+
+    def request(self, m_method, model_id, image, compact=False):
+        self.send(m_method, model_id, image, compact)
+        return self.receive()[1]
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+# Entry point: send an image to a running server, e.g. python BinaryProtocol.py -i hand.jpg -m gesture -n 100
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Client for the TM vision binary protocol')
+    parser.add_argument('-i', '--input', required=True, help='Image to send')
+    parser.add_argument('-m', '--model_id', required=True, help='model_id to run')
+    parser.add_argument('--method', default='DET', choices=METHODS, help='CLS or DET')
+    parser.add_argument('--host', default='127.0.0.1', help='Server address')
+    parser.add_argument('--port', type=int, default=4586, help='Binary protocol port of the server')
+    parser.add_argument('-n', '--count', type=int, default=1, help='Requests to send')
+    parser.add_argument('-p', '--pipeline', type=int, default=8, help='Requests in flight at once')
+    parser.add_argument('--encoded', action='store_true', help='Send the image file as is instead of raw pixels')
+    parser.add_argument('--compact', action='store_true', help='Ask for the compact binary result encoding')
+    args = parser.parse_args()
+
+    if args.encoded:
+        with open(args.input, 'rb') as f:
+            image = f.read()
+    else:
+        image = cv2.imread(args.input)
+
+    with VisionClient(args.host, args.port) as client:
+        start = time.perf_counter()
+        in_flight = 0
+        response = None
+        for _ in range(args.count):
+            if in_flight >= args.pipeline:
+                response = client.receive()[1]
+                in_flight -= 1
+            client.send(args.method, args.model_id, image, args.compact)
+            in_flight += 1
+        while in_flight:
+            response = client.receive()[1]
+            in_flight -= 1
+        elapsed = time.perf_counter() - start
+
+    print(json.dumps(response, indent=4))
+    print(f'{args.count} requests in {elapsed * 1000.0:.1f} ms ({args.count / elapsed:.1f} req/s)')
@@ -1,23 +1,130 @@
 import cv2
-from fer import FER
 import argparse
 import os
 import json
+from VideoPipeline import FramePipeline, is_live_source
+from BatchInput import is_batch_input, run_batch
+from ResultsSink import video_results_sink
+from VideoSink import add_video_arguments, open_video_writer
+from OnnxBackend import add_backend_arguments, use_backend
+
+def create_tracker():
+    """Pick the cheapest single object tracker this OpenCV build ships."""
+    for name in ('TrackerKCF_create', 'TrackerCSRT_create', 'TrackerMIL_create'):
+        factory = getattr(cv2, name, None) or getattr(getattr(cv2, 'legacy', None), name, None)
+        if factory is not None:
+            return factory()
+    return None
+
+class FaceTracker:
+    """Follows faces between MTCNN detections so only the emotion classifier runs on most frames.
+
+    MTCNN runs every detect_every frames and never in between. There each
+    face is followed by a cheap OpenCV tracker; when a tracker loses its face,
+    or this OpenCV build has no trackers, the Haar cascade looks for faces on
+    that frame, and if it finds none the frame has no faces until the next
+    MTCNN run. Empty scenes therefore cost a cascade pass, not MTCNN.
+    """
+    def __init__(self, detector, face_cascade, detect_every=10):
+        self.detector = detector
+        self.face_cascade = face_cascade
+        self.detect_every = detect_every
+        self.trackers = []
+        # The first frame always runs MTCNN
+        self.frames_since_detection = detect_every
+
+    def start_tracking(self, frame, boxes):
+        self.trackers = []
+        for box in boxes:
+            tracker = create_tracker()
+            if tracker is None:
+                break
+            tracker.init(frame, tuple(int(v) for v in box))
+            self.trackers.append(tracker)
+
+    def track(self, frame):
+        boxes = []
+        for tracker in self.trackers:
+            ok, box = tracker.update(frame)
+            if not ok:
+                return None
+            boxes.append([int(v) for v in box])
+        return boxes
+
+    def cascade_faces(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5, minSize=(40, 40))
+        return [list(map(int, face)) for face in faces]
+
+    @staticmethod
+    def clip_boxes(frame, boxes):
+        """Clip (x, y, w, h) boxes to the frame, trackers drift past its edges; boxes left empty are dropped."""
+        height, width = frame.shape[:2]
+        clipped = []
+        for x, y, w, h in boxes:
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(width, x + w), min(height, y + h)
+            if x1 > x0 and y1 > y0:
+                clipped.append([x0, y0, x1 - x0, y1 - y0])
+        return clipped
+
+    def detect(self, frame):
+        """Return FER results (box and emotions) for every face in the frame."""
+        self.frames_since_detection += 1
+        if self.frames_since_detection >= self.detect_every:
+            self.frames_since_detection = 0
+            results = self.detector.detect_emotions(frame)
+            self.start_tracking(frame, [result['box'] for result in results])
+            return results
+        boxes = self.track(frame) if self.trackers else None
+        if boxes is None:
+            # Tracking lost (or no trackers), try the fast cascade; MTCNN waits for its turn
+            boxes = self.cascade_faces(frame)
+            self.start_tracking(frame, boxes)
+        boxes = self.clip_boxes(frame, boxes)
+        if not boxes:
+            return []
+        # Faces are known, FER only has to classify the crops
+        return self.detector.detect_emotions(frame, face_rectangles=boxes)
+
+def describe_face(box, emotion, score):
+    x, y, w, h = (int(v) for v in box)
+    return {
+        "box_cx": x + w//2,
+        "box_cy": y + h//2,
+        "box_w": w,
+        "box_h": h,
+        "label": emotion,
+        "score": score,
+        "rotation": 0.0  # Assuming no rotation
+    }
+
+def draw_face(image, box, emotion):
+    x, y, w, h = (int(v) for v in box)
+    cv2.rectangle(image, (x, y), (x+w, y+h), (255, 0, 0), 2)
+    cv2.putText(image, emotion, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
 
 class EmotionDetection:
-    def __init__(self, input_path=None, output_path=None, no_image=False, json_output=False, play=False):
-        if input_path.endswith('.jpg') or input_path.endswith('.png'):
+    def __init__(self, input_path=None, output_path=None, no_image=False, json_output=False, play=False, capture=True, detect_every=10, compress=False, video_options=None):
+        if input_path is not None and (input_path.endswith('.jpg') or input_path.endswith('.png')):
             self.mode = 'image'
             self.image = cv2.imread(input_path)
         else:
             self.mode = 'video'
-            self.cap = cv2.VideoCapture(input_path if input_path else 0)
+            # capture=False leaves the camera closed when frames come from elsewhere (e.g. the HTTP server)
+            self.cap = cv2.VideoCapture(input_path if input_path else 0) if capture else None
+        # FER pulls in TensorFlow, imported only once a detector is built
+        from fer import FER
         self.detector = FER(mtcnn=True)
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.face_tracker = FaceTracker(self.detector, self.face_cascade, detect_every)
+        self.input_path = input_path
         self.output_path = output_path
         self.no_image = no_image
         self.json_output = json_output
         self.play = play
+        self.compress = compress
+        self.video_options = video_options
 
     def detect_emotion(self, frame):
         try:
@@ -28,24 +135,26 @@ class EmotionDetection:
         except:
             return None, None
 
+    def process_frame(self, frame, track=True):
+        """Detect (or track) faces in a video frame, draw them and return their outputs."""
+        outputs = []
+        # Unrelated images (batch mode) can't reuse faces from the previous frame
+        results = self.face_tracker.detect(frame) if track else self.detector.detect_emotions(frame)
+        for result in results:
+            emotions = result['emotions']
+            emotion = max(emotions, key=emotions.get)
+            draw_face(frame, result['box'], emotion)
+            outputs.append(describe_face(result['box'], emotion, round(float(emotions[emotion]), 3)))
+        return outputs
+
     def run(self):
         outputs = []
 
         if self.mode == 'image':
             emotion, box = self.detect_emotion(self.image)
             if emotion:
-                x, y, w, h = box
-                cv2.rectangle(self.image, (x, y), (x+w, y+h), (255, 0, 0), 2)
-                cv2.putText(self.image, emotion, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-                outputs.append({
-                    "box_cx": x + w//2,
-                    "box_cy": y + h//2,
-                    "box_w": w,
-                    "box_h": h,
-                    "label": emotion,
-                    "score": 1.0,  # Assuming score as 1 for simplicity
-                    "rotation": 0.0  # Assuming no rotation
-                })
+                draw_face(self.image, box, emotion)
+                outputs.append(describe_face(box, emotion, 1.0))  # Assuming score as 1 for simplicity
             if self.play:
                 cv2.imshow('Emotion Detection', self.image)
                 cv2.waitKey(0)
@@ -53,24 +162,63 @@ class EmotionDetection:
             if self.output_path and not self.no_image:
                 cv2.imwrite(self.output_path, self.image)
         else:
-            # Handle video processing similar to your original code
-            pass
+            live = is_live_source(self.input_path)
+            out = None
+            if self.output_path and not self.no_image:
+                out = open_video_writer(self.output_path, self.cap, live, self.video_options)
+            # Faces of every frame are streamed to output.jsonl rather than collected for the end of the run
+            sink = video_results_sink('output.jsonl', self.cap, live, self.compress) if self.json_output else None
+            try:
+                with FramePipeline(self.cap, self.process_frame, live) as pipeline:
+                    for frame, frame_outputs in pipeline:
+                        if sink is not None:
+                            sink.write_frame(frame_outputs)
+                        if self.play:
+                            cv2.imshow('Emotion Detection', frame)
+                        if out is not None:
+                            out.write(frame)
+                        if cv2.waitKey(1) & 0xFF == ord('q'):
+                            break
+            finally:
+                if sink is not None:
+                    sink.close()
+                if out is not None:
+                    out.close()
+            self.cap.release()
+            cv2.destroyAllWindows()
 
-        if self.json_output:
+        if self.json_output and self.mode == 'image':
             with open('output.json', 'w') as f:
                 json.dump(outputs, f)
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description='Emotion Detection from Image or Video')
-    parser.add_argument('-i', '--input', required=True, help='Path to input image or video')
-    parser.add_argument('-o', '--output', help='Path to save output image or video')
+    parser.add_argument('-i', '--input', required=True, help='Path to input image or video, or a directory, glob or manifest file of images')
+    parser.add_argument('-o', '--output', help='Path to save output image or video (output directory in batch mode)')
     parser.add_argument('-n', '--no_image', action='store_true', help='Skip saving the image')
     parser.add_argument('-j', '--json', action='store_true', help='Output results as JSON')
     parser.add_argument('-p', '--play', action='store_true', help='Display the image or video')
-    args = parser.parse_args()
+    parser.add_argument('-z', '--compress', action='store_true', help='Gzip the JSON Lines output of video runs')
+    parser.add_argument('-k', '--detect_every', type=int, default=10, help='Run the MTCNN face detector every K video frames and track faces in between')
+    parser.add_argument('--workers', type=int, default=4, help='Threads reading and writing images in batch mode')
+    add_video_arguments(parser)
+    add_backend_arguments(parser)
+    args = parser.parse_args(argv)
 
-    if args.output:
-        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    if is_batch_input(args.input):
+        # One FER model for every image, results go to a single results.jsonl in the output directory
+        ed = EmotionDetection(None, args.output, args.no_image, False, args.play, capture=False)
+        use_backend(ed.detector, 'emotion', args)
+        run_batch(args.input, lambda image: ed.process_frame(image, track=False), args.output, args.workers,
+                  save_images=bool(args.output) and not args.no_image)
+    else:
+        if args.output:
+            os.makedirs(os.path.dirname(args.output), exist_ok=True)
 
-    ed = EmotionDetection(args.input, args.output, args.no_image, args.json, args.play)
-    ed.run()
+        ed = EmotionDetection(args.input, args.output, args.no_image, args.json, args.play, detect_every=args.detect_every, compress=args.compress,
+                              video_options=args)
+        use_backend(ed.detector, 'emotion', args)
+        ed.run()
+
+if __name__ == "__main__":
+    cli()
@@ -1,56 +1,45 @@
 import cv2
-import mediapipe as mp
 import argparse
 import os
 import json
+from VideoPipeline import FramePipeline, is_live_source
+from HandTracking import hands_from_options, add_adaptive_arguments, report_model_rate
+from BatchInput import is_batch_input, run_batch
+from HandLandmarks import hands_to_array, finger_counts, is_right_hand
+from ResultsSink import video_results_sink
+from VideoSink import add_video_arguments, open_video_writer, is_video_path
 
 class FingerCounter:
-    def __init__(self, input_path, output_path, no_image, json_output, play):
+    def __init__(self, input_path, output_path, no_image, json_output, play, max_hands=2, compress=False, video_options=None):
         self.input_path = input_path
         self.output_path = output_path
         self.no_image = no_image
         self.json_output = json_output
         self.play = play
-        self.results_list = []
-
-        self.mp_hands = mp.solutions.hands
-        self.hands = self.mp_hands.Hands()
-        self.mp_draw = mp.solutions.drawing_utils
+        self.compress = compress
+        self.video_options = video_options
+        # Output of the last processed frame; video runs stream every frame's output to results_sink
+        self.last_output = None
+        self.results_sink = None
 
         # Determine if input is an image or video
-        if input_path.endswith('.jpg') or input_path.endswith('.png'):
+        if input_path is None:
+            self.input_type = None
+        elif input_path.endswith('.jpg') or input_path.endswith('.png'):
             self.input_type = 'image'
             self.image = cv2.imread(input_path)
         else:
             self.input_type = 'video'
             self.cap = cv2.VideoCapture(input_path)
 
-    def count_fingers(self, landmarks):
-        finger_tips = [4, 8, 12, 16, 20]
-        count = 0
-
-        # Determine if it's a left or right hand
-        if landmarks[17].x > landmarks[5].x:
-            hand_type = "Right"
-        else:
-            hand_type = "Left"
-
-        # Thumb
-        if hand_type == "Right":
-            if landmarks[4].x < landmarks[3].x and landmarks[4].y < landmarks[3].y:
-                count += 1
-        else:
-            if landmarks[4].x > landmarks[3].x and landmarks[4].y < landmarks[3].y:
-                count += 1
-
-        # Other fingers
-        for i in range(1, 5):
-            if landmarks[finger_tips[i]].y < landmarks[finger_tips[i]-2].y:
-                count += 1
-
-        return count
+        # Imported on first use so the module (and its --help) loads without mediapipe
+        import mediapipe as mp
+        self.mp_hands = mp.solutions.hands
+        self.hands = hands_from_options(self.mp_hands, self.input_type == 'video', max_hands, video_options)
+        self.mp_draw = mp.solutions.drawing_utils
 
-    def process_frame(self, frame):
+    def count_frame(self, frame):
+        """Count the fingers of every hand, draw the counts and return the frame's output."""
         rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         results = self.hands.process(rgb_frame)
     
@@ -58,11 +47,14 @@ class FingerCounter:
         right_hand_count = None
 
         if results.multi_hand_landmarks:
-            for hand_landmarks in results.multi_hand_landmarks:
+            # Convert every hand once and evaluate the rules on the stacked array
+            points = hands_to_array(results.multi_hand_landmarks)
+            counts = finger_counts(points).tolist()
+            right_hands = is_right_hand(points).tolist()
+            for hand_landmarks, finger_count, right_hand in zip(results.multi_hand_landmarks, counts, right_hands):
                 self.mp_draw.draw_landmarks(frame, hand_landmarks, self.mp_hands.HAND_CONNECTIONS)
-                finger_count = self.count_fingers(hand_landmarks.landmark)
             
-                hand_type = "Right" if hand_landmarks.landmark[17].x > hand_landmarks.landmark[5].x else "Left"
+                hand_type = "Right" if right_hand else "Left"
             
                 if hand_type == "Left":
                     left_hand_count = finger_count
@@ -75,14 +67,16 @@ class FingerCounter:
                 x, y = int(hand_landmarks.landmark[0].x * frame.shape[1]), int(hand_landmarks.landmark[0].y * frame.shape[0])
                 cv2.putText(frame, display_text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1.5, color, 3, cv2.LINE_AA)
 
-        # Add results to results_list for JSON output
-        output = {
+        return {
             "Number_of_fingers_left": left_hand_count,
             "Number_of_fingers_right": right_hand_count,
             "Hand_detected": bool(results.multi_hand_landmarks)
         }
-        self.results_list.append(output)
 
+    def process_frame(self, frame):
+        self.last_output = self.count_frame(frame)
+        if self.results_sink is not None:
+            self.results_sink.write_frame(self.last_output)
         return frame
 
 
@@ -97,38 +91,62 @@ class FingerCounter:
                 cv2.imwrite(self.output_path, processed_image)
             if self.json_output:
                 with open('output.json', 'w') as f:
-                    json.dump(self.results_list[0], f)
+                    json.dump(self.last_output, f)
         else:
-            while True:
-                ret, frame = self.cap.read()
-                if not ret:
-                    break
-                processed_frame = self.process_frame(frame)
-                if self.play:
-                    cv2.imshow('Finger Counter', processed_frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
+            live = is_live_source(self.input_path)
+            if self.json_output:
+                # One line per frame as it is processed, so memory stays flat on long recordings
+                self.results_sink = video_results_sink('output.jsonl', self.cap, live, self.compress)
+            out = None
+            if is_video_path(self.output_path) and not self.no_image:
+                out = open_video_writer(self.output_path, self.cap, live, self.video_options)
+            try:
+                # Capture, inference and encoding run in their own threads, display stays on the main thread
+                with FramePipeline(self.cap, self.process_frame, live) as pipeline:
+                    for _, processed_frame in pipeline:
+                        if out is not None:
+                            out.write(processed_frame)
+                        if self.play:
+                            cv2.imshow('Finger Counter', processed_frame)
+                        if cv2.waitKey(1) & 0xFF == ord('q'):
+                            break
+            finally:
+                if self.results_sink is not None:
+                    self.results_sink.close()
+                if out is not None:
+                    out.close()
+            report_model_rate(self.hands)
             self.cap.release()
             cv2.destroyAllWindows()
-            if self.json_output:
-                with open('output.json', 'w') as f:
-                    json.dump(self.results_list, f)
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description='Finger Counter using MediaPipe')
-    parser.add_argument('-i', '--input', required=True, help='Path to input image or video')
-    parser.add_argument('-o', '--output', help='Path to save processed image or video')
+    parser.add_argument('-i', '--input', required=True, help='Path to input image or video, or a directory, glob or manifest file of images')
+    parser.add_argument('-o', '--output', help='Path to save processed image or video (output directory in batch mode)')
     parser.add_argument('-n', '--no_image', action='store_true', help='Skip removing the image')
     parser.add_argument('-j', '--json', action='store_true', help='Output predicted parameter values as a JSON file')
     parser.add_argument('-p', '--play', action='store_true', help='Display the processed image or video')
+    parser.add_argument('-z', '--compress', action='store_true', help='Gzip the JSON Lines output of video runs')
+    parser.add_argument('-m', '--max_hands', type=int, default=2, help='Maximum number of hands to track')
+    parser.add_argument('--workers', type=int, default=4, help='Threads reading and writing images in batch mode')
+    add_video_arguments(parser)
+    add_adaptive_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    if is_batch_input(args.input):
+        # One Hands model for every image, results go to a single results.jsonl in the output directory
+        fc = FingerCounter(None, args.output, args.no_image, False, args.play, args.max_hands)
+        run_batch(args.input, fc.count_frame, args.output, args.workers, save_images=bool(args.output) and not args.no_image)
+    else:
+        # Check if output directory exists, if not create it
+        if args.output:
+            output_dir = os.path.dirname(args.output)
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+
+        fc = FingerCounter(args.input, args.output, args.no_image, args.json, args.play, args.max_hands, args.compress, args)
+        fc.run()
 
-    args = parser.parse_args()
-
-    # Check if output directory exists, if not create it
-    if args.output:
-        output_dir = os.path.dirname(args.output)
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-    fc = FingerCounter(args.input, args.output, args.no_image, args.json, args.play)
-    fc.run()
+if __name__ == "__main__":
+    cli()
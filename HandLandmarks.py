@@ -0,0 +1,135 @@
+import numpy as np
+
+# MediaPipe hand landmark indices used by the rules below
+WRIST = 0
+THUMB_IP, THUMB_TIP = 3, 4
+INDEX_MCP, INDEX_PIP, INDEX_TIP = 5, 6, 8
+MIDDLE_PIP, MIDDLE_TIP = 10, 12
+RING_PIP, RING_TIP = 14, 16
+PINKY_MCP, PINKY_PIP, PINKY_TIP = 17, 18, 20
+
+# Labels in the priority order of the rules in gesture_labels, the last entry is the "no rule matched" answer
+GESTURE_LABELS = np.array(["nothing", "Index pointing right", "Index pointing left", "Index pointing down",
+                           "Index pointing up", "bad", "Hold up two fingers", "promise", "like", "dislike",
+                           "ok", None], dtype=object)
+RPS_LABELS = np.array(["Rock (Hammer)", "Scissors", "Paper", None], dtype=object)
+
+
+def landmarks_to_array(landmarks):
+    """Turn one hand's MediaPipe landmark list into a (21, 3) float32 array of x, y, z."""
+    if isinstance(landmarks, np.ndarray):
+        return landmarks
+    return np.array([(landmark.x, landmark.y, landmark.z) for landmark in landmarks], dtype=np.float32)
+
+
+def hands_to_array(multi_hand_landmarks):
+    """Stack every hand of a MediaPipe result into a (hands, 21, 3) array."""
+    if not multi_hand_landmarks:
+        return np.zeros((0, 21, 3), dtype=np.float32)
+    return np.stack([landmarks_to_array(hand_landmarks.landmark) for hand_landmarks in multi_hand_landmarks])
+
+
+def first_match(conditions, labels):
+    """Pick, per hand, the label of the first true condition, like an if/elif chain."""
+    conditions = np.stack(conditions + [np.ones_like(conditions[0])], axis=-1)
+    return labels[np.argmax(conditions, axis=-1)]
+
+
+def gesture_labels(points, threshold=0.06):
+    """GestureRecognition rules for points of shape (..., 21, 3); returns labels of shape (...)."""
+    points = np.asarray(points, dtype=np.float32)
+    x, y = points[..., 0], points[..., 1]
+    dx = x[..., INDEX_TIP] - x[..., INDEX_MCP]
+    dy = y[..., INDEX_TIP] - y[..., INDEX_MCP]
+    thumb_down = y[..., THUMB_TIP] > y[..., THUMB_IP]
+    index_down = y[..., INDEX_TIP] > y[..., INDEX_PIP]
+    middle_down = y[..., MIDDLE_TIP] > y[..., MIDDLE_PIP]
+    ring_down = y[..., RING_TIP] > y[..., RING_PIP]
+    pinky_down = y[..., PINKY_TIP] > y[..., PINKY_PIP]
+    pinch = np.linalg.norm(points[..., THUMB_TIP, :] - points[..., INDEX_TIP, :], axis=-1)
+
+    conditions = [
+        thumb_down & index_down & middle_down & ring_down & pinky_down,
+        (np.abs(dx) > threshold) & (dx > np.abs(dy)),
+        (np.abs(dx) > threshold) & (dx < -np.abs(dy)),
+        (np.abs(dy) > threshold) & (dy > np.abs(dx)),
+        (np.abs(dy) > threshold) & (dy < -np.abs(dx)),
+        (y[..., MIDDLE_TIP] < y[..., MIDDLE_PIP]) & index_down & ring_down & pinky_down,
+        (y[..., INDEX_TIP] < y[..., INDEX_PIP] - 0.02) & (y[..., MIDDLE_TIP] < y[..., MIDDLE_PIP] - 0.02) &
+        (y[..., RING_TIP] > y[..., RING_PIP] + 0.02) & (y[..., PINKY_TIP] > y[..., PINKY_PIP] + 0.02),
+        (pinch < 0.05) & ring_down,
+        (y[..., THUMB_TIP] < y[..., THUMB_IP]) & ring_down,
+        (y[..., THUMB_TIP] > y[..., THUMB_IP] - 0.03) & (y[..., RING_TIP] > y[..., RING_PIP] - 0.03),
+        y[..., RING_TIP] < y[..., RING_PIP],
+    ]
+    return first_match(conditions, GESTURE_LABELS)
+
+
+def rps_labels(points):
+    """Rock/Paper/Scissors rules of GestureGame for points of shape (..., 21, 3)."""
+    y = np.asarray(points, dtype=np.float32)[..., 1]
+    index_down = y[..., INDEX_TIP] > y[..., INDEX_PIP]
+    middle_down = y[..., MIDDLE_TIP] > y[..., MIDDLE_PIP]
+    ring_down = y[..., RING_TIP] > y[..., RING_PIP]
+    pinky_down = y[..., PINKY_TIP] > y[..., PINKY_PIP]
+    index_up = y[..., INDEX_TIP] < y[..., INDEX_PIP]
+    middle_up = y[..., MIDDLE_TIP] < y[..., MIDDLE_PIP]
+    ring_up = y[..., RING_TIP] < y[..., RING_PIP]
+    pinky_up = y[..., PINKY_TIP] < y[..., PINKY_PIP]
+    conditions = [
+        index_down & middle_down & ring_down & pinky_down,
+        index_up & middle_up & ring_down & pinky_down,
+        index_up & middle_up & ring_up & pinky_up,
+    ]
+    return first_match(conditions, RPS_LABELS)
+
+
+def is_right_hand(points):
+    """FingerCounter's handedness rule: the pinky knuckle is right of the index knuckle."""
+    x = np.asarray(points, dtype=np.float32)[..., 0]
+    return x[..., PINKY_MCP] > x[..., INDEX_MCP]
+
+
+def finger_counts(points):
+    """Number of raised fingers per hand for points of shape (..., 21, 3)."""
+    points = np.asarray(points, dtype=np.float32)
+    x, y = points[..., 0], points[..., 1]
+    thumb_out = np.where(is_right_hand(points), x[..., THUMB_TIP] < x[..., THUMB_IP], x[..., THUMB_TIP] > x[..., THUMB_IP])
+    thumb_up = thumb_out & (y[..., THUMB_TIP] < y[..., THUMB_IP])
+    tips = y[..., [INDEX_TIP, MIDDLE_TIP, RING_TIP, PINKY_TIP]]
+    pips = y[..., [INDEX_PIP, MIDDLE_PIP, RING_PIP, PINKY_PIP]]
+    return thumb_up.astype(np.int32) + np.sum(tips < pips, axis=-1, dtype=np.int32)
+
+
+def raised(points, threshold=0.5):
+    """HandRaiseDetection rule: the wrist is in the upper part of the image."""
+    return np.asarray(points, dtype=np.float32)[..., WRIST, 1] < threshold
+
+
+def bounding_boxes(points, width=1.0, height=1.0):
+    """(cx, cy, w, h) per hand, in normalized units unless the image size is given."""
+    xy = np.asarray(points, dtype=np.float32)[..., :2] * np.array([width, height], dtype=np.float32)
+    center = xy.mean(axis=-2)
+    size = xy.max(axis=-2) - xy.min(axis=-2)
+    return np.concatenate([center, size], axis=-1)
+
+
+def rotations(points, width=1.0, height=1.0):
+    """Angle in degrees of the wrist to middle finger tip direction per hand."""
+    points = np.asarray(points, dtype=np.float32)
+    dx = (points[..., MIDDLE_TIP, 0] - points[..., WRIST, 0]) * width
+    dy = (points[..., MIDDLE_TIP, 1] - points[..., WRIST, 1]) * height
+    return np.degrees(np.arctan2(dy, dx))
+
+
+def classify_session(points, threshold=0.06):
+    """Evaluate every rule at once, e.g. on a recorded session stacked as (frames, hands, 21, 3)."""
+    return {
+        "gesture": gesture_labels(points, threshold),
+        "rps": rps_labels(points),
+        "fingers": finger_counts(points),
+        "right_hand": is_right_hand(points),
+        "raised": raised(points),
+        "box": bounding_boxes(points),
+        "rotation": rotations(points),
+    }
@@ -1,28 +1,37 @@
 import cv2
-import mediapipe as mp
 import argparse
 import os
 import json
+from VideoPipeline import FramePipeline, is_live_source
+from BatchInput import is_batch_input, run_batch
+from HandLandmarks import hands_to_array, raised
+from ResultsSink import video_results_sink
+from VideoSink import add_video_arguments, open_video_writer
+from HandTracking import hands_from_options, add_adaptive_arguments, report_model_rate
 
 class HandRaiseDetection:
-    def __init__(self, input_path, output_path, no_image, json_output, play):
+    def __init__(self, input_path, output_path, no_image, json_output, play, video_options=None):
         self.input_path = input_path
+        # Parsed add_video_arguments options (codec, quality, segments, ffmpeg) for the annotated video
+        self.video_options = video_options
         self.output_path = output_path
         self.no_image = no_image
         self.json_output = json_output
         self.play = play
 
+        # Imported on first use so the module (and its --help) loads without mediapipe
+        import mediapipe as mp
         self.mp_hands = mp.solutions.hands
-        self.hands = self.mp_hands.Hands()
+        # Without an input path frames are unrelated batch images, so detect palms on each one
+        video = input_path is not None and not self.is_image()
+        self.hands = hands_from_options(self.mp_hands, video, 2, video_options)
         self.mp_draw = mp.solutions.drawing_utils
 
-    def is_hand_raised(self, landmarks):
-        # Check if the wrist's y-coordinate is above a certain threshold
-        if landmarks[0].y < 0.5:  # Adjust the threshold value as needed
-            return True
-        return False
+    def is_image(self):
+        return self.input_path.endswith('.jpg') or self.input_path.endswith('.png')
 
-    def process_image(self, image):
+    def analyze(self, image):
+        """Find raised hands, draw them and return the MediaPipe results with the frame's output."""
         # Convert the BGR image to RGB
         rgb_frame = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
@@ -33,9 +42,10 @@ class HandRaiseDetection:
 
         # If hand landmarks are found, draw them and check if hand is raised
         if results.multi_hand_landmarks:
-            for hand_landmarks, hand_info in zip(results.multi_hand_landmarks, results.multi_handedness):
+            hands_raised = raised(hands_to_array(results.multi_hand_landmarks))
+            for hand_landmarks, hand_info, hand_raised in zip(results.multi_hand_landmarks, results.multi_handedness, hands_raised):
                 self.mp_draw.draw_landmarks(image, hand_landmarks, self.mp_hands.HAND_CONNECTIONS)
-                if self.is_hand_raised(hand_landmarks.landmark):
+                if hand_raised:
                     label = "Left" if hand_info.classification[0].label == "Left" else "Right"
                     raised_hands.append(label)
 
@@ -49,13 +59,18 @@ class HandRaiseDetection:
             message = ""
 
         cv2.putText(image, message, (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2, cv2.LINE_AA)
+        return results, {"raised_hands": raised_hands, "message": message}
+
+    def process_image(self, image):
+        results, _ = self.analyze(image)
         return image, results
 
     def run(self):
-        if self.input_path.endswith('.jpg') or self.input_path.endswith('.png'):
+        if self.is_image():
             # Process image
             image = cv2.imread(self.input_path)
-            processed_image, results = self.process_image(image)
+            results, output = self.analyze(image)
+            processed_image = image
             if self.play:
                 cv2.imshow('Hand Raise Detection', processed_image)
                 cv2.waitKey(0)
@@ -63,44 +78,60 @@ class HandRaiseDetection:
             if not self.no_image:
                 cv2.imwrite(self.output_path, processed_image)
             if self.json_output:
-                # Save results to JSON (modify as needed)
-                output_data = {
-                    # Add your desired JSON output format here
-                }
                 with open(self.json_output, 'w') as json_file:
-                    json.dump(output_data, json_file)
+                    json.dump(output, json_file)
         else:
             # Process video
             cap = cv2.VideoCapture(self.input_path)
-            fourcc = cv2.VideoWriter_fourcc(*'XVID')
-            out = cv2.VideoWriter(self.output_path, fourcc, 20.0, (int(cap.get(3)), int(cap.get(4))))
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                processed_frame, results = self.process_image(frame)
-                if self.play:
-                    cv2.imshow('Hand Raise Detection', processed_frame)
-                out.write(processed_frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
+            live = is_live_source(self.input_path)
+            # Encoded on the writer's own thread, at the source's frame rate and size
+            out = open_video_writer(self.output_path, cap, live, self.video_options) if not self.no_image else None
+            sink = video_results_sink(self.json_output, cap, live) if self.json_output else None
+            try:
+                # Capture, inference and encoding run in their own threads, display stays on the main thread
+                with FramePipeline(cap, self.analyze, live) as pipeline:
+                    for processed_frame, (results, output) in pipeline:
+                        if sink is not None:
+                            sink.write_frame(output)
+                        if self.play:
+                            cv2.imshow('Hand Raise Detection', processed_frame)
+                        if out is not None:
+                            out.write(processed_frame)
+                        if cv2.waitKey(1) & 0xFF == ord('q'):
+                            break
+            finally:
+                if sink is not None:
+                    sink.close()
+                if out is not None:
+                    out.close()
+            report_model_rate(self.hands)
             cap.release()
-            out.release()
             cv2.destroyAllWindows()
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description='Hand Raise Detection')
-    parser.add_argument('-i', '--input', required=True, help='Path to input image/video')
-    parser.add_argument('-o', '--output', required=True, help='Path to save output image/video')
+    parser.add_argument('-i', '--input', required=True, help='Path to input image/video, or a directory, glob or manifest file of images')
+    parser.add_argument('-o', '--output', required=True, help='Path to save output image/video (output directory in batch mode)')
     parser.add_argument('-n', '--no_image', action='store_true', help='Skip saving the image')
-    parser.add_argument('-j', '--json', help='Path to save the JSON output')
+    parser.add_argument('-j', '--json', help='Path to save the JSON output (JSON Lines, one line per frame, for videos; gzipped if it ends in .gz)')
     parser.add_argument('-p', '--play', action='store_true', help='Display the processed image/video')
-    args = parser.parse_args()
+    parser.add_argument('--workers', type=int, default=4, help='Threads reading and writing images in batch mode')
+    add_video_arguments(parser)
+    add_adaptive_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if is_batch_input(args.input):
+        # One Hands model for every image, results go to a single results.jsonl in the output directory
+        hrd = HandRaiseDetection(None, args.output, args.no_image, None, args.play)
+        run_batch(args.input, lambda image: hrd.analyze(image)[1], args.output, args.workers, save_images=not args.no_image)
+    else:
+        # Create output directory if it doesn't exist
+        output_dir = os.path.dirname(args.output)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
 
-    # Create output directory if it doesn't exist
-    output_dir = os.path.dirname(args.output)
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+        hrd = HandRaiseDetection(args.input, args.output, args.no_image, args.json, args.play, args)
+        hrd.run()
 
-    hrd = HandRaiseDetection(args.input, args.output, args.no_image, args.json, args.play)
-    hrd.run()
+if __name__ == "__main__":
+    cli()
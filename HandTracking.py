@@ -0,0 +1,248 @@
+import argparse
+import json
+import math
+import time
+from types import SimpleNamespace
+import numpy as np
+from HandLandmarks import hands_to_array
+
+
+def create_hands(mp_hands, video, max_num_hands=2, target_fps=0, max_skip=8):
+    """Build a Hands solution configured for the input: tracking plus ROI cropping for video, palm detection per image otherwise.
+
+    With a target_fps video frames are also skipped adaptively (see AdaptiveHands).
+    """
+    if not video:
+        return mp_hands.Hands(static_image_mode=True, max_num_hands=max_num_hands)
+    # Crops and full frames go to separate graphs so the full scans never disturb the tracking on the crop
+    hands = RoiHands(mp_hands.Hands(static_image_mode=False, max_num_hands=max_num_hands,
+                                    min_detection_confidence=0.5, min_tracking_confidence=0.5),
+                     mp_hands.Hands(static_image_mode=True, max_num_hands=max_num_hands))
+    return AdaptiveHands(hands, target_fps, max_skip) if target_fps > 0 else hands
+
+
+class RoiHands:
+    """Drop-in wrapper for mp.solutions.hands.Hands that only looks where the hands were.
+
+    After a frame with hands, the next frames are landmarked on a crop around
+    the previous hand boxes (expanded by margin) instead of the full frame.
+    The crop window is kept fixed while the hands stay inside its inner part,
+    so MediaPipe's own landmark tracking keeps working in crop coordinates.
+    The full frame is scanned again when a hand is lost and every
+    full_frame_every frames to pick up hands entering the scene. Landmarks
+    are mapped back to full frame normalized coordinates, so callers can use
+    the results exactly as before.
+
+    MediaPipe tracks in coordinates normalized to its previous input, so
+    hands (tracking mode) only ever sees crops and the full scans go to
+    full_hands (static image mode); with one graph for both, every full scan
+    and crop change would throw the tracking away and cost a palm detection.
+    """
+    def __init__(self, hands, full_hands=None, margin=0.5, min_size=160, full_frame_every=30):
+        self.hands = hands
+        self.full_hands = full_hands if full_hands is not None else hands
+        self.margin = margin
+        self.min_size = min_size
+        self.full_frame_every = full_frame_every
+        self.roi = None
+        self.num_hands = 0
+        self.frames_since_full = 0
+        self.full_scans = 0
+
+    def close(self):
+        self.hands.close()
+        if self.full_hands is not self.hands:
+            self.full_hands.close()
+
+    def hand_boxes(self, multi_hand_landmarks, width, height):
+        xy = hands_to_array(multi_hand_landmarks)[..., :2] * np.array([width, height], dtype=np.float32)
+        return np.concatenate([xy.min(axis=1), xy.max(axis=1)], axis=1).tolist()
+
+    def roi_around(self, boxes, width, height):
+        x0 = min(box[0] for box in boxes)
+        y0 = min(box[1] for box in boxes)
+        x1 = max(box[2] for box in boxes)
+        y1 = max(box[3] for box in boxes)
+        pad = self.margin * max(x1 - x0, y1 - y0, self.min_size / 2)
+        cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+        half_w = max((x1 - x0) / 2 + pad, self.min_size / 2)
+        half_h = max((y1 - y0) / 2 + pad, self.min_size / 2)
+        return (max(int(cx - half_w), 0), max(int(cy - half_h), 0),
+                min(int(cx + half_w), width), min(int(cy + half_h), height))
+
+    def inside_inner_roi(self, boxes):
+        # Hands that drift into the outer 5% of the crop trigger a new one
+        x0, y0, x1, y1 = self.roi
+        inset_x, inset_y = (x1 - x0) * 0.05, (y1 - y0) * 0.05
+        return all(box[0] >= x0 + inset_x and box[1] >= y0 + inset_y and
+                   box[2] <= x1 - inset_x and box[3] <= y1 - inset_y for box in boxes)
+
+    def process(self, rgb_frame):
+        height, width = rgb_frame.shape[:2]
+        self.frames_since_full += 1
+        if self.roi is not None and self.frames_since_full < self.full_frame_every:
+            x0, y0, x1, y1 = self.roi
+            results = self.hands.process(np.ascontiguousarray(rgb_frame[y0:y1, x0:x1]))
+            found = len(results.multi_hand_landmarks) if results.multi_hand_landmarks else 0
+            if found >= self.num_hands:
+                crop_w, crop_h = x1 - x0, y1 - y0
+                for hand_landmarks in results.multi_hand_landmarks:
+                    for landmark in hand_landmarks.landmark:
+                        landmark.x = (x0 + landmark.x * crop_w) / width
+                        landmark.y = (y0 + landmark.y * crop_h) / height
+                        landmark.z = landmark.z * crop_w / width
+                boxes = self.hand_boxes(results.multi_hand_landmarks, width, height)
+                if not self.inside_inner_roi(boxes):
+                    self.roi = self.roi_around(boxes, width, height)
+                self.num_hands = found
+                return results
+
+        # No previous hands, a hand was lost or it is time for a periodic full scan
+        results = self.full_hands.process(rgb_frame)
+        self.full_scans += 1
+        self.frames_since_full = 0
+        if results.multi_hand_landmarks:
+            self.num_hands = len(results.multi_hand_landmarks)
+            self.roi = self.roi_around(self.hand_boxes(results.multi_hand_landmarks, width, height), width, height)
+        else:
+            self.num_hands = 0
+            self.roi = None
+        return results
+
+
+def add_adaptive_arguments(parser):
+    """Adaptive frame skipping options of the hand tracking scripts."""
+    parser.add_argument('--target_fps', type=float, default=0, help='Skip model frames (extrapolating landmarks) to hold this frame rate on video (0 runs the model on every frame)')
+    parser.add_argument('--max_skip', type=int, default=8, help='Run the model on at least every Nth frame with --target_fps')
+
+
+def hands_from_options(mp_hands, video, max_num_hands, options=None):
+    """create_hands configured from add_adaptive_arguments options."""
+    return create_hands(mp_hands, video, max_num_hands, getattr(options, 'target_fps', 0), getattr(options, 'max_skip', 8))
+
+
+def report_model_rate(hands):
+    """Print the effective model rate of an adaptive run."""
+    if isinstance(hands, AdaptiveHands):
+        print(json.dumps(hands.stats()))
+
+
+class AdaptiveHands:
+    """Wrapper for a Hands solution that runs the model on every Nth frame only, to hold target_fps.
+
+    N follows an exponential moving average of the model's time per call:
+    the smallest N (up to max_skip) for which one model call spread over N
+    frames fits the 1 / target_fps frame budget. On the frames in between,
+    every landmark is extrapolated linearly from the last two model results
+    (or held when there is only one, or the number of hands changed) and
+    kept inside the image, so boxes and rotations derived from them keep
+    moving with the hand. The
+    results look like MediaPipe's, so callers use them unchanged.
+    """
+    def __init__(self, hands, target_fps, max_skip=8, smoothing=0.2):
+        self.hands = hands
+        self.frame_budget = 1.0 / target_fps
+        self.max_skip = max_skip
+        self.smoothing = smoothing
+        self.model_seconds = None
+        self.interval = 1
+        self.frame = -1
+        # (frame index, MediaPipe results, (hands, 21, 3) landmark array) of the last two model calls
+        self.keyframes = []
+        self.model_runs = 0
+        self.start = time.monotonic()
+
+    def close(self):
+        self.hands.close()
+
+    def process(self, rgb_frame):
+        self.frame += 1
+        if not self.keyframes or self.frame - self.keyframes[-1][0] >= self.interval:
+            return self.run_model(rgb_frame)
+        return self.extrapolate()
+
+    def run_model(self, rgb_frame):
+        start = time.perf_counter()
+        results = self.hands.process(rgb_frame)
+        seconds = time.perf_counter() - start
+        self.model_seconds = seconds if self.model_seconds is None else \
+            (1 - self.smoothing) * self.model_seconds + self.smoothing * seconds
+        self.interval = min(max(1, math.ceil(self.model_seconds / self.frame_budget)), self.max_skip)
+        self.model_runs += 1
+        points = hands_to_array(results.multi_hand_landmarks)
+        if self.keyframes and len(self.keyframes[-1][2]) == len(points) == 2:
+            # MediaPipe may list the hands in either order, keep them matched to the previous call by wrist position
+            previous = self.keyframes[-1][2]
+            if (np.linalg.norm(points[::-1, 0, :2] - previous[:, 0, :2]) <
+                    np.linalg.norm(points[:, 0, :2] - previous[:, 0, :2])):
+                points = points[::-1]
+                results = SimpleNamespace(multi_hand_landmarks=results.multi_hand_landmarks[::-1],
+                                          multi_handedness=results.multi_handedness[::-1])
+        self.keyframes = (self.keyframes + [(self.frame, results, points)])[-2:]
+        return results
+
+    def extrapolate(self):
+        frame, results, points = self.keyframes[-1]
+        if not results.multi_hand_landmarks:
+            return results
+        if len(self.keyframes) == 2 and len(self.keyframes[0][2]) == len(points):
+            previous_frame, _, previous_points = self.keyframes[0]
+            velocity = (points - previous_points) / (frame - previous_frame)
+            points = points + velocity * (self.frame - frame)
+            # A hand that stopped would otherwise overshoot for up to max_skip frames, possibly off the frame
+            points[..., :2] = np.clip(points[..., :2], 0.0, 1.0)
+        hands = []
+        for template, hand_points in zip(results.multi_hand_landmarks, points.tolist()):
+            hand = type(template)()
+            hand.CopyFrom(template)
+            for landmark, (x, y, z) in zip(hand.landmark, hand_points):
+                landmark.x, landmark.y, landmark.z = x, y, z
+            hands.append(hand)
+        return SimpleNamespace(multi_hand_landmarks=hands, multi_handedness=results.multi_handedness)
+
+    def stats(self):
+        """Frames seen, model calls and the effective model rate, for the end of a run."""
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        return {
+            "frames": self.frame + 1,
+            "model_runs": self.model_runs,
+            "model_fps": round(self.model_runs / elapsed, 2),
+            "output_fps": round((self.frame + 1) / elapsed, 2),
+            "model_ms": round(self.model_seconds * 1000.0, 2) if self.model_seconds is not None else None,
+            "interval": self.interval,
+        }
+
+
+def compare_tracking(frames, max_num_hands=2):
+    """Time MediaPipe's tracking Hands on full frames against RoiHands on the same frames, in ms per frame."""
+    import cv2
+    import mediapipe as mp
+    mp_hands = mp.solutions.hands
+    report = {}
+    for name in ('full_frame', 'roi'):
+        hands = mp_hands.Hands(static_image_mode=False, max_num_hands=max_num_hands,
+                               min_detection_confidence=0.5, min_tracking_confidence=0.5)
+        if name == 'roi':
+            hands = create_hands(mp_hands, True, max_num_hands)
+        rgb_frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+        start = time.perf_counter()
+        for rgb_frame in rgb_frames:
+            hands.process(rgb_frame)
+        report[name] = {"ms_per_frame": round((time.perf_counter() - start) / len(frames) * 1000.0, 2),
+                        "full_scans": getattr(hands, 'full_scans', len(frames))}
+        hands.close()
+    return report
+
+
+def cli(argv=None):
+    from Benchmark import recorded_frames
+    parser = argparse.ArgumentParser(description='Measure RoiHands against full frame hand tracking on a recorded video')
+    parser.add_argument('-i', '--input', required=True, help='Video file, or a directory, glob or manifest file of frames')
+    parser.add_argument('-f', '--frames', type=int, default=300, help='Frames to read from the input')
+    parser.add_argument('-m', '--max_hands', type=int, default=2, help='Maximum number of hands to track')
+    args = parser.parse_args(argv)
+    print(json.dumps(compare_tracking(recorded_frames(args.input, args.frames), args.max_hands), indent=4))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,84 @@
+import threading
+import queue
+import time
+from concurrent.futures import Future
+
+
+class InferenceScheduler:
+    """Groups concurrent requests for the same model_id into micro-batches.
+
+    Each model_id gets one worker thread. The worker waits for a first request,
+    keeps collecting for up to window_ms (or until max_batch images are queued),
+    runs the whole batch through the registry and hands every caller its result.
+    When the batch call fails, its images are retried one by one so only the
+    requests whose own image fails get the error.
+    """
+    def __init__(self, registry, window_ms=5.0, max_batch=8):
+        # registry is anything with is_known/infer_batch: a ModelRegistry or a WorkerPool
+        self.registry = registry
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.queues = {}
+        self.lock = threading.Lock()
+
+    def is_known(self, model_id):
+        return self.registry.is_known(model_id)
+
+    def queue_for(self, model_id):
+        model_queue = self.queues.get(model_id)
+        if model_queue is None:
+            with self.lock:
+                model_queue = self.queues.get(model_id)
+                if model_queue is None:
+                    model_queue = queue.Queue()
+                    worker = threading.Thread(target=self.worker, args=(model_id, model_queue),
+                                              name=f'batch-{model_id}', daemon=True)
+                    worker.start()
+                    self.queues[model_id] = model_queue
+        return model_queue
+
+    def submit(self, model_id, image):
+        future = Future()
+        self.queue_for(model_id).put((image, future))
+        return future
+
+    def infer(self, model_id, image):
+        return self.submit(model_id, image).result()
+
+    def queue_depths(self):
+        return {model_id: model_queue.qsize() for model_id, model_queue in self.queues.items()}
+
+    def worker(self, model_id, model_queue):
+        while True:
+            batch = [model_queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(model_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            images = [image for image, _ in batch]
+            try:
+                results = self.registry.infer_batch(model_id, images)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self.run_each(model_id, batch)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            # A backend answering fewer images than it got must not leave the remaining callers waiting forever
+            for _, future in batch[len(results):]:
+                future.set_exception(RuntimeError(f"'{model_id}' returned {len(results)} results for a batch of {len(batch)}"))
+
+    def run_each(self, model_id, batch):
+        for image, future in batch:
+            try:
+                future.set_result(self.registry.infer(model_id, image))
+            except Exception as e:
+                future.set_exception(e)
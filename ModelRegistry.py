@@ -0,0 +1,248 @@
+import threading
+from functools import partial
+import cv2
+from HandLandmarks import hands_to_array, bounding_boxes, rotations, gesture_labels, rps_labels, finger_counts, raised
+
+
+def to_bgr(image):
+    """Convert a decoded upload (gray, BGR or BGRA) to the 3 channel BGR layout the detectors expect."""
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image
+
+
+class HandModel:
+    """Wraps one of the MediaPipe hand detectors so it can answer DET requests.
+
+    By default every image is unrelated (server requests) and the palm detector
+    runs on each one. With video=True the model follows hands from frame to
+    frame like the detector scripts do, so it must only ever see one stream.
+    """
+    def __init__(self, detector, labels_fn, video=False):
+        from HandTracking import create_hands
+        self.detector = detector
+        # labels_fn(points, hands) maps the (hands, 21, 3) landmark array and handedness labels to one label per hand
+        self.labels_fn = labels_fn
+        self.detector.hands.close()
+        self.detector.hands = create_hands(self.detector.mp_hands, video=video, max_num_hands=2)
+        self.last_results = None
+
+    def infer(self, image):
+        rgb_frame = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        results = self.detector.hands.process(rgb_frame)
+        self.last_results = results
+        annotations = []
+        if results.multi_hand_landmarks:
+            height, width = image.shape[:2]
+            points = hands_to_array(results.multi_hand_landmarks)
+            classifications = [handedness.classification[0] for handedness in results.multi_handedness]
+            labels = self.labels_fn(points, [classification.label for classification in classifications])
+            boxes = bounding_boxes(points, width, height).round(1).tolist()
+            hand_rotations = rotations(points, width, height).round(2).tolist()
+            for classification, label, box, rotation in zip(classifications, labels, boxes, hand_rotations):
+                box_cx, box_cy, box_w, box_h = box
+                annotations.append({
+                    "box_cx": box_cx,
+                    "box_cy": box_cy,
+                    "box_w": box_w,
+                    "box_h": box_h,
+                    "label": label,
+                    "score": round(classification.score, 3),
+                    "rotation": rotation
+                })
+        return annotations
+
+    def draw(self, image, annotations):
+        """Draw the last infer call's hands the way the detector scripts do: landmarks plus one label line per hand."""
+        if not self.last_results or not self.last_results.multi_hand_landmarks:
+            return
+        for index, (hand_landmarks, annotation) in enumerate(zip(self.last_results.multi_hand_landmarks, annotations)):
+            self.detector.mp_draw.draw_landmarks(image, hand_landmarks, self.detector.mp_hands.HAND_CONNECTIONS)
+            cv2.putText(image, annotation["label"], (50, 50 + 40 * index), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2, cv2.LINE_AA)
+
+
+class EmotionModel:
+    def __init__(self, detector):
+        self.detector = detector
+
+    def infer(self, image):
+        annotations = []
+        for face in self.detector.detector.detect_emotions(image):
+            x, y, w, h = (int(v) for v in face['box'])
+            emotions = face['emotions']
+            emotion = max(emotions, key=emotions.get)
+            annotations.append({
+                "box_cx": x + w // 2,
+                "box_cy": y + h // 2,
+                "box_w": w,
+                "box_h": h,
+                "label": emotion,
+                "score": round(float(emotions[emotion]), 3),
+                "rotation": 0.0
+            })
+        return annotations
+
+    def draw(self, image, annotations):
+        from FaceEmotion import draw_face
+        for annotation in annotations:
+            box = (annotation["box_cx"] - annotation["box_w"] // 2, annotation["box_cy"] - annotation["box_h"] // 2,
+                   annotation["box_w"], annotation["box_h"])
+            draw_face(image, box, annotation["label"])
+
+
+class OCRModel:
+    def __init__(self, reader):
+        from OCR_Detection import OCREngine
+        self.reader = reader
+        self.engine = OCREngine(reader)
+        self.last_result = []
+
+    def infer(self, image):
+        from OCR_Detection import detections_to_outputs
+        self.last_result = self.engine.readtext(image)
+        return detections_to_outputs(self.last_result)
+
+    def infer_batch(self, images):
+        from OCR_Detection import detections_to_outputs
+        # readtext_batched stacks the inputs, so it only applies when every image has the same size,
+        # and only pays off over the engine when that size needs no downscaling for detection
+        if len(images) > 1 and len({image.shape for image in images}) == 1 and self.engine.scale_for(images[0].shape) == 1.0:
+            return [detections_to_outputs(result) for result in self.reader.readtext_batched(images)]
+        return [self.infer(image) for image in images]
+
+
+    def draw(self, image, annotations):
+        from OCR_Detection import draw_detections
+        draw_detections(image, self.last_result, annotations)
+
+
+class QRModel:
+    def infer(self, image):
+        from QR_Code import decode_codes
+        return decode_codes(image)
+
+    def draw(self, image, annotations):
+        # Same boxes and labels as QR_Code.draw_codes, from the outputs since the pyzbar results are not kept
+        for annotation in annotations:
+            x, y = annotation["box_cx"] - annotation["box_w"] // 2, annotation["box_cy"] - annotation["box_h"] // 2
+            cv2.rectangle(image, (x, y), (x + annotation["box_w"], y + annotation["box_h"]), (0, 255, 0), 2)
+            cv2.putText(image, annotation["label"], (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+
+
+# Loaders import their backend on first use so the server only pays for the models it serves
+def load_gesture(video=False):
+    from GestureRecognition import GestureRecognition
+    detector = GestureRecognition(None, None, False, True, False, 0.06)
+    return HandModel(detector, lambda points, hands: [label or "none" for label in gesture_labels(points, detector.threshold)], video)
+
+
+def load_fingers(video=False):
+    from FingerCounter import FingerCounter
+    detector = FingerCounter(None, None, True, False, False)
+    return HandModel(detector, lambda points, hands: [str(count) for count in finger_counts(points)], video)
+
+
+def load_handraise(video=False):
+    from HandRaiseDetection import HandRaiseDetection
+    detector = HandRaiseDetection(None, None, True, False, False)
+    return HandModel(detector, lambda points, hands: [f"{hand} raised" if up else f"{hand} lowered" for hand, up in zip(hands, raised(points))], video)
+
+
+def load_rps(video=False):
+    import argparse
+    from Rock_Paper_Scissors import GestureGame
+    detector = GestureGame(argparse.Namespace(input=None, output=None, no_image=True, json=False, play=False), capture=False)
+    return HandModel(detector, lambda points, hands: [label or "none" for label in rps_labels(points)], video)
+
+
+def load_emotion(backend=None):
+    from FaceEmotion import EmotionDetection
+    from OnnxBackend import use_backend
+    detection = EmotionDetection(None, capture=False)
+    use_backend(detection.detector, 'emotion', backend)
+    return EmotionModel(detection)
+
+
+def load_ocr(backend=None):
+    import easyocr
+    from OnnxBackend import use_backend
+    reader = easyocr.Reader(['en'])
+    use_backend(reader, 'ocr', backend)
+    return OCRModel(reader)
+
+
+def load_qr():
+    return QRModel()
+
+
+# Hand models track hands between frames when loaded with video=True (see HandModel)
+TRACKING_MODELS = ('gesture', 'fingers', 'handraise', 'rps')
+
+MODEL_LOADERS = {
+    'gesture': load_gesture,
+    'fingers': load_fingers,
+    'handraise': load_handraise,
+    'rps': load_rps,
+    'emotion': load_emotion,
+    'ocr': load_ocr,
+    'qr': load_qr,
+}
+
+
+def backend_loaders(backend):
+    """MODEL_LOADERS with the FER and easyocr networks run by the given backend options (see OnnxBackend)."""
+    return dict(MODEL_LOADERS, emotion=partial(load_emotion, backend), ocr=partial(load_ocr, backend))
+
+
+class ModelRegistry:
+    """Keeps one warm model instance per model_id and serializes access to it."""
+    def __init__(self, loaders=None):
+        self.loaders = loaders if loaders is not None else MODEL_LOADERS
+        self.models = {}
+        self.model_locks = {lid: threading.Lock() for lid in self.loaders}
+        self.load_lock = threading.Lock()
+
+    def is_known(self, model_id):
+        return model_id in self.loaders
+
+    def get(self, model_id):
+        model = self.models.get(model_id)
+        if model is None:
+            if not self.is_known(model_id):
+                raise KeyError(f"unknown model_id '{model_id}'")
+            # Load under the registry lock so concurrent first hits don't build the model twice
+            with self.load_lock:
+                model = self.models.get(model_id)
+                if model is None:
+                    model = self.loaders[model_id]()
+                    self.models[model_id] = model
+        return model
+
+    def preload(self, model_ids):
+        for model_id in model_ids:
+            self.get(model_id)
+
+    def infer(self, model_id, image):
+        model = self.get(model_id)
+        # MediaPipe graphs and the FER/easyocr networks are not safe to call from several threads at once
+        with self.model_locks[model_id]:
+            return model.infer(to_bgr(image))
+
+    def infer_batch(self, model_id, images):
+        """Run several images through one model, using its batched path when it has one."""
+        model = self.get(model_id)
+        images = [to_bgr(image) for image in images]
+        with self.model_locks[model_id]:
+            if hasattr(model, 'infer_batch'):
+                return model.infer_batch(images)
+            return [model.infer(image) for image in images]
+
+
+def classify(annotations):
+    """Reduce DET annotations to a CLS answer: the most confident label, or NG when nothing was found."""
+    if not annotations:
+        return "NG", 0.0
+    best = max(annotations, key=lambda annotation: annotation["score"])
+    return best["label"], best["score"]
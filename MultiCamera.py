@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import cv2
+from ModelRegistry import MODEL_LOADERS, TRACKING_MODELS, backend_loaders
+from VideoPipeline import is_live_source
+from ResultsSink import video_results_sink
+from Annotations import draw_annotations
+from OnnxBackend import add_backend_arguments, backend_options
+
+
+class Stream:
+    """One input source: its capture, the newest frame waiting for inference and its counters."""
+    def __init__(self, index, source):
+        self.index = index
+        self.source = source
+        self.live = is_live_source(source)
+        self.cap = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+        self.pending = None
+        self.busy = False
+        self.finished = False
+        self.sink = None
+        # Tracking model of this stream only, None when the stream uses the shared pool
+        self.model = None
+        self.captured = 0
+        self.processed = 0
+        self.dropped = 0
+        self.inference_seconds = 0.0
+        self.start = time.monotonic()
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        return {
+            "stream": self.index,
+            "source": str(self.source),
+            "captured": self.captured,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "fps": round(self.processed / elapsed, 2),
+            "inference_ms": round(self.inference_seconds / self.processed * 1000.0, 2) if self.processed else None,
+        }
+
+
+class MultiCamera:
+    """Runs one model_id over several video sources with a shared pool of model instances.
+
+    Every source gets a capture thread, but only `workers` inference threads
+    share the CPU. Workers take the next stream with a waiting frame in
+    round-robin order and each stream has at most one frame in flight, so a
+    fast camera cannot starve the others. Live sources keep only their newest
+    frame; files are processed frame by frame.
+
+    Stateless models (emotion, ocr, qr) are a pool of `workers` instances,
+    one per inference thread, so memory grows with the pool rather than with
+    the number of cameras. Hand models follow each stream's hands between
+    frames instead of running the palm detector on every frame, so every
+    stream gets its own tracking graph, run by whichever worker takes it.
+    backend holds OnnxBackend options for the emotion and OCR networks.
+    """
+    def __init__(self, sources, model_id, workers=2, on_result=None, backend=None):
+        loaders = backend_loaders(backend)
+        self.streams = [Stream(index, source) for index, source in enumerate(sources)]
+        if model_id in TRACKING_MODELS:
+            for stream in self.streams:
+                stream.model = loaders[model_id](video=True)
+            self.models = [None] * workers
+        else:
+            self.models = [loaders[model_id]() for _ in range(workers)]
+        self.on_result = on_result
+        self.condition = threading.Condition()
+        self.next_stream = 0
+        self.stopped = False
+        self.threads = [threading.Thread(target=self.capture, args=(stream,), name=f'capture-{stream.index}', daemon=True)
+                        for stream in self.streams]
+        self.threads += [threading.Thread(target=self.infer, args=(model,), name=f'inference-{number}', daemon=True)
+                         for number, model in enumerate(self.models)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        for stream, thread in zip(self.streams, self.threads):
+            # A capture thread still inside a slow cap.read() releases its capture itself when the read returns;
+            # releasing it here during the read crashes some OpenCV backends
+            if not thread.is_alive():
+                stream.cap.release()
+
+    def running(self):
+        with self.condition:
+            return not self.stopped and any(not stream.finished or stream.pending is not None or stream.busy
+                                            for stream in self.streams)
+
+    def capture(self, stream):
+        try:
+            while not self.stopped:
+                ret, frame = stream.cap.read()
+                with self.condition:
+                    if not ret:
+                        stream.finished = True
+                        self.condition.notify_all()
+                        return
+                    stream.captured += 1
+                    # Files wait for their previous frame to be taken; live sources replace it
+                    while not stream.live and stream.pending is not None and not self.stopped:
+                        self.condition.wait()
+                    if stream.pending is not None:
+                        stream.dropped += 1
+                    stream.pending = frame
+                    self.condition.notify_all()
+        finally:
+            if self.stopped:
+                stream.cap.release()
+
+    def take(self):
+        """Next (stream, frame) in round-robin order, skipping streams with nothing waiting or a frame in flight."""
+        count = len(self.streams)
+        with self.condition:
+            while not self.stopped:
+                for offset in range(count):
+                    stream = self.streams[(self.next_stream + offset) % count]
+                    if stream.pending is not None and not stream.busy:
+                        self.next_stream = (stream.index + 1) % count
+                        frame, stream.pending = stream.pending, None
+                        stream.busy = True
+                        self.condition.notify_all()
+                        return stream, frame
+                if all(stream.finished and stream.pending is None for stream in self.streams):
+                    return None, None
+                self.condition.wait()
+        return None, None
+
+    def infer(self, model):
+        while True:
+            stream, frame = self.take()
+            if stream is None:
+                return
+            start = time.perf_counter()
+            try:
+                annotations = (stream.model or model).infer(frame)
+            except Exception as e:
+                annotations = []
+                print(f'stream {stream.index}: {e}')
+            # Only this thread works on the stream until busy is cleared, so its sink sees frames in order
+            stream.inference_seconds += time.perf_counter() - start
+            stream.processed += 1
+            if stream.sink is not None:
+                stream.sink.write_frame(annotations)
+            if self.on_result is not None:
+                self.on_result(stream, frame, annotations)
+            with self.condition:
+                stream.busy = False
+                self.condition.notify_all()
+
+    def stats(self):
+        return [stream.stats() for stream in self.streams]
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description='Run one detector over several cameras or videos in one process')
+    parser.add_argument('-i', '--inputs', nargs='+', required=True, help='Camera indices, stream URLs or video files')
+    parser.add_argument('-m', '--model_id', default='gesture', choices=list(MODEL_LOADERS), help='Detector to run on every stream')
+    parser.add_argument('-w', '--workers', type=int, default=2, help='Inference threads shared by all streams, each with its own instance of a stateless model')
+    parser.add_argument('-o', '--output', help='Directory for one JSON Lines results file per stream')
+    parser.add_argument('-p', '--play', action='store_true', help='Display every stream with its annotations')
+    parser.add_argument('-s', '--stats_every', type=float, default=5.0, help='Print per-stream FPS every N seconds (0 only at the end)')
+    add_backend_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # Workers hand annotated frames to the main thread, which owns the windows
+    shown = queue.Queue(maxsize=2 * len(args.inputs))
+
+    def show(stream, frame, annotations):
+        draw_annotations(frame, annotations)
+        try:
+            shown.put_nowait((stream.index, frame))
+        except queue.Full:
+            pass
+
+    cameras = MultiCamera(args.inputs, args.model_id, args.workers, show if args.play else None, backend_options(args))
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        for stream in cameras.streams:
+            stream.sink = video_results_sink(os.path.join(args.output, f'stream{stream.index}.jsonl'), stream.cap, stream.live)
+
+    cameras.start()
+    last_report = time.monotonic()
+    try:
+        while cameras.running():
+            try:
+                index, frame = shown.get(timeout=0.05)
+                cv2.imshow(f'Stream {index}', frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+            except queue.Empty:
+                pass
+            if args.stats_every > 0 and time.monotonic() - last_report >= args.stats_every:
+                last_report = time.monotonic()
+                for stats in cameras.stats():
+                    print(json.dumps(stats))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cameras.stop()
+        for stream in cameras.streams:
+            if stream.sink is not None:
+                stream.sink.close()
+        if args.play:
+            cv2.destroyAllWindows()
+    print(json.dumps({"model_id": args.model_id, "workers": args.workers, "streams": cameras.stats()}, indent=4))
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,69 +1,144 @@
-import easyocr
 import cv2
 import math
 import argparse
 import os
 import json
+import functools
+import numpy as np
+from BatchInput import is_batch_input, run_batch
+from OnnxBackend import add_backend_arguments, use_backend
 
-def compute_font_scale(text, width, height, font=cv2.FONT_HERSHEY_SIMPLEX, initial_scale=0.5):
+def compute_font_scale(text, width, height, font=cv2.FONT_HERSHEY_SIMPLEX):
     """Computes the optimal font scale to make the text fit within the specified width and height."""
-    scale = initial_scale
-    (text_width, text_height), _ = cv2.getTextSize(text, font, fontScale=scale, thickness=2)
-    
-    while text_width < width * 0.8 and text_height < height * 0.8:
-        scale += 0.1
-        (text_width, text_height), _ = cv2.getTextSize(text, font, fontScale=scale, thickness=2)
-        
-    while (text_width > width or text_height > height) and scale > 0.1:
-        scale -= 0.1
-        (text_width, text_height), _ = cv2.getTextSize(text, font, fontScale=scale, thickness=2)
-    
-    return scale
+    # Text size grows linearly with the scale, so one measurement at scale 1 gives the answer:
+    # the text fills 90% of the box in its tighter direction, as the old 0.1 step search ended up doing
+    text_width, text_height = unit_text_size(text, font)
+    return max(0.1, 0.9 * min(width / text_width, height / text_height))
 
-def main(args):
-    # Create an OCR reader instance for English
-    reader = easyocr.Reader(['en'])
+@functools.lru_cache(maxsize=4096)
+def unit_text_size(text, font):
+    """Size of the text at font scale 1, cached since the same labels repeat across frames."""
+    (text_width, text_height), _ = cv2.getTextSize(text or ' ', font, fontScale=1.0, thickness=2)
+    return max(text_width, 1), max(text_height, 1)
 
-    # Read from an image file
-    img = cv2.imread(args.input)
-    result = reader.readtext(args.input)
-    Count_Detect = 0
-    outputs = []
+class OCREngine:
+    """readtext() in two passes: text detection on a downscaled copy, recognition on the full resolution crops.
 
-    # Process and display the results
-    for detection in result:
+    easyocr's own readtext detects on the full image (resized to at most 2560 px
+    inside the detector) and recognizes one crop at a time. Here the image is
+    shrunk with INTER_AREA so its long side is at most detect_size before
+    detection, the boxes are scaled back, and Reader.recognize upsamples every
+    region from the full resolution gray image, batch_size crops per forward
+    pass. With tiles > 1 detection runs on a tiles x tiles grid of overlapping
+    tiles instead, so small print on very large labels keeps enough pixels.
+    Results have the same (box, text, score) format as Reader.readtext.
+    """
+    def __init__(self, reader, detect_size=1280, tiles=1, overlap=0.1, batch_size=8, min_size=20):
+        self.reader = reader
+        self.detect_size = detect_size
+        self.tiles = max(1, tiles)
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.min_size = min_size
+
+    def scale_for(self, shape):
+        """Factor detection works at for an image (or tile) of this shape, 1.0 when no downscaling is needed."""
+        longest = max(shape[:2])
+        return self.detect_size / longest if 0 < self.detect_size < longest else 1.0
+
+    def detect(self, image):
+        """Text regions of one image or tile as easyocr (horizontal, free) lists, in the image's own pixels."""
+        scale = self.scale_for(image.shape)
+        small = image if scale == 1.0 else cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        horizontal_list, free_list = self.reader.detect(small, min_size=max(1, int(self.min_size * scale)))
+        horizontal, free = horizontal_list[0], free_list[0]
+        if scale != 1.0:
+            horizontal = [[int(v / scale) for v in box] for box in horizontal]
+            free = [[[int(x / scale), int(y / scale)] for x, y in box] for box in free]
+        return horizontal, free
+
+    def tile_origins(self, length):
+        size = int(math.ceil(length / (self.tiles - (self.tiles - 1) * self.overlap)))
+        step = int(size * (1.0 - self.overlap))
+        return [min(i * step, length - size) for i in range(self.tiles)], size
+
+    def detect_tiled(self, image):
+        height, width = image.shape[:2]
+        ys, tile_h = self.tile_origins(height)
+        xs, tile_w = self.tile_origins(width)
+        horizontal, free = [], []
+        for y0 in ys:
+            for x0 in xs:
+                tile_horizontal, tile_free = self.detect(image[y0:y0 + tile_h, x0:x0 + tile_w])
+                horizontal.extend([x_min + x0, x_max + x0, y_min + y0, y_max + y0] for x_min, x_max, y_min, y_max in tile_horizontal)
+                free.extend([[x + x0, y + y0] for x, y in box] for box in tile_free)
+        return merge_boxes(horizontal), free
+
+    def readtext(self, image):
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        horizontal, free = self.detect_tiled(image) if self.tiles > 1 else self.detect(image)
+        if not horizontal and not free:
+            return []
+        return self.reader.recognize(gray, horizontal, free, batch_size=self.batch_size)
+
+def merge_boxes(boxes, threshold=0.5):
+    """Drop [x_min, x_max, y_min, y_max] boxes mostly covered by a larger one, i.e. text found twice where tiles overlap."""
+    if not boxes:
+        return boxes
+    array = np.asarray(boxes, dtype=np.float64)
+    areas = (array[:, 1] - array[:, 0]) * (array[:, 3] - array[:, 2])
+    kept = []
+    for i in np.argsort(-areas):
+        x_min, x_max, y_min, y_max = array[i]
+        duplicate = False
+        for j in kept:
+            inter_w = min(x_max, array[j, 1]) - max(x_min, array[j, 0])
+            inter_h = min(y_max, array[j, 3]) - max(y_min, array[j, 2])
+            if inter_w > 0 and inter_h > 0 and inter_w * inter_h > threshold * max(areas[i], 1.0):
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(i)
+    return [boxes[i] for i in sorted(kept)]
+
+def describe_detection(detection, number):
+    """Convert one easyocr (box, text, score) tuple into the TM vision output format."""
+    top_left = tuple(map(int, detection[0][0]))
+    top_right = tuple(map(int, detection[0][1]))
+    bottom_right = tuple(map(int, detection[0][2]))
+
+    # Calculate center, width, and height of the bounding box
+    box_cx = int((top_left[0] + bottom_right[0]) / 2)
+    box_cy = int((top_left[1] + bottom_right[1]) / 2)
+    box_w = int(bottom_right[0] - top_left[0])
+    box_h = int(bottom_right[1] - top_left[1])
+
+    # Calculate rotation angle in degrees
+    delta_x = top_right[0] - top_left[0]
+    delta_y = top_right[1] - top_left[1]
+    rotation = math.degrees(math.atan2(delta_y, delta_x))
+
+    return {
+        "Number": number,
+        "box_cx": box_cx,
+        "box_cy": box_cy,
+        "box_w": box_w,
+        "box_h": box_h,
+        "label": detection[1],
+        "score": round(float(detection[2]), 3),  # Confidence score
+        "rotation": round(rotation, 2)
+    }
+
+def detections_to_outputs(result):
+    return [describe_detection(detection, number) for number, detection in enumerate(result, start=1)]
+
+def draw_detections(img, result, outputs):
+    for detection, output in zip(result, outputs):
         top_left = tuple(map(int, detection[0][0]))
-        top_right = tuple(map(int, detection[0][1]))
         bottom_right = tuple(map(int, detection[0][2]))
-        bottom_left = tuple(map(int, detection[0][3]))
-
-        # Calculate center, width, and height of the bounding box
-        box_cx = int((top_left[0] + bottom_right[0]) / 2)
-        box_cy = int((top_left[1] + bottom_right[1]) / 2)
-        box_w = int(bottom_right[0] - top_left[0])
-        box_h = int(bottom_right[1] - top_left[1])
-
-        # Calculate rotation angle in degrees
-        delta_x = top_right[0] - top_left[0]
-        delta_y = top_right[1] - top_left[1]
-        rotation = math.degrees(math.atan2(delta_y, delta_x))
-
-        text = detection[1]
-        score = detection[2]  # Confidence score
-        Count_Detect += 1
-
-        # Output the bounding box properties in the specified format
-        output = {
-            "Number": Count_Detect,
-            "box_cx": box_cx,
-            "box_cy": box_cy,
-            "box_w": box_w,
-            "box_h": box_h,
-            "label": text,
-            "score": round(score, 3),
-            "rotation": round(rotation, 2)
-        }
-        outputs.append(output)
+        text = output["label"]
+        box_w = output["box_w"]
+        box_h = output["box_h"]
 
         # Compute appropriate font scale for the bounding box
         font_scale = compute_font_scale(text, box_w, box_h)
@@ -74,14 +149,43 @@ def main(args):
         # Display text inside rectangle
         bottom_left_text = (top_left[0], top_left[1] + int(box_h * 0.9))
         img = cv2.putText(img, text, bottom_left_text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2, cv2.LINE_AA)
+    return img
+
+def main(args):
+    # Create an OCR reader instance for English (easyocr loads PyTorch, so it is imported here)
+    import easyocr
+    reader = easyocr.Reader(['en'])
+    use_backend(reader, 'ocr', args)
+    engine = OCREngine(reader, args.detect_size, args.tiles, batch_size=args.batch_size)
+
+    if is_batch_input(args.input):
+        # One reader for the whole batch, images are decoded ahead on worker threads
+        def process(image):
+            result = engine.readtext(image)
+            outputs = detections_to_outputs(result)
+            if not args.no_overlay:
+                draw_detections(image, result, outputs)
+            return outputs
+        run_batch(args.input, process, args.output, args.workers, save_images=bool(args.output) and not args.no_overlay)
+        return
+
+    # Read from an image file once and run OCR on the decoded array
+    img = cv2.imread(args.input)
+    result = engine.readtext(img)
+    outputs = detections_to_outputs(result)
+
+    # Process and display the results
+    if not args.no_overlay:
+        img = draw_detections(img, result, outputs)
 
     # Save the image if output path is provided
     if args.output:
-        # Create directory if it doesn't exist
+        # Create directory if it doesn't exist (the JSON file goes next to the image)
         output_dir = os.path.dirname(args.output)
-        if not os.path.exists(output_dir):
+        if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir)
-        cv2.imwrite(args.output, img)
+        if not args.no_overlay:
+            cv2.imwrite(args.output, img)
 
     # Save the results as JSON if the json flag is provided
     if args.json:
@@ -90,16 +194,26 @@ def main(args):
             json.dump(outputs, json_file, indent=4)
 
     # Display the image unless no_image flag is provided
-    if not args.no_image:
+    if not args.no_image and not args.no_overlay:
         cv2.imshow('Annotated Image', img)
         cv2.waitKey(0)
         cv2.destroyAllWindows()
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description="OCR Image Processing")
-    parser.add_argument("-i", "--input", required=True, help="Path to the input image")
-    parser.add_argument("-o", "--output", help="Path to save the output image")
+    parser.add_argument("-i", "--input", required=True, help="Path to the input image, or a directory, glob or manifest file of images")
+    parser.add_argument("-o", "--output", help="Path to save the output image (output directory in batch mode)")
     parser.add_argument("-n", "--no_image", action="store_true", help="Skip displaying the image")
     parser.add_argument("-j", "--json", action="store_true", help="Output the results as a JSON file")
-    args = parser.parse_args()
+    parser.add_argument("--no_overlay", action="store_true", help="Skip drawing, saving and displaying the annotated image (JSON only)")
+    parser.add_argument("--detect_size", type=int, default=1280,
+                        help="Longest side text detection runs at, larger images are downscaled for it (0 detects at full resolution)")
+    parser.add_argument("--tiles", type=int, default=1, help="Detect text on an NxN grid of overlapping tiles, for very large labels")
+    parser.add_argument("--batch_size", type=int, default=8, help="Text regions recognized per forward pass")
+    parser.add_argument("--workers", type=int, default=4, help="Threads reading and writing images in batch mode")
+    add_backend_arguments(parser)
+    args = parser.parse_args(argv)
     main(args)
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,336 @@
+import argparse
+import difflib
+import json
+import os
+import time
+import cv2
+import numpy as np
+from BatchInput import is_batch_input, expand_inputs
+
+BACKENDS = ('default', 'onnx', 'onnx-int8')
+MODEL_DIR = 'onnx_models'
+RUNTIMES = {'onnx': 'onnxruntime float32', 'onnx-int8': 'onnxruntime dynamic int8'}
+# Model kind -> attribute of the FER detector / easyocr Reader that holds the network being replaced
+MODEL_ATTRIBUTES = {'emotion': '_FER__emotion_classifier', 'ocr': 'recognizer'}
+# easyocr recognizes lines 64 pixels high and predicts at most 25 characters (+1 for the start token)
+RECOGNIZER_HEIGHT = 64
+RECOGNIZER_MAX_LENGTH = 26
+
+
+def export_emotion(detector, path):
+    """Convert FER's Keras emotion classifier (faces, 64, 64, 1) -> (faces, 7) to ONNX."""
+    import tensorflow as tf
+    import tf2onnx
+    classifier = getattr(detector, MODEL_ATTRIBUTES['emotion'])
+    spec = (tf.TensorSpec((None,) + tuple(classifier.input_shape[1:]), tf.float32, name='faces'),)
+    tf2onnx.convert.from_keras(classifier, input_signature=spec, opset=13, output_path=path)
+
+
+def export_recognizer(reader, path):
+    """Convert easyocr's PyTorch recognizer to ONNX with a dynamic batch and line width."""
+    import torch
+    import easyocr
+    # On CPU easyocr quantizes the reader's recognizer with torch dynamic quantization, which ONNX export
+    # does not support, so the float network is loaded again for the export
+    float_reader = easyocr.Reader(reader.lang_list, gpu=False, detector=False, quantize=False, verbose=False)
+    recognizer = float_reader.recognizer
+    # On a GPU machine easyocr wraps the network in DataParallel
+    model = getattr(recognizer, 'module', recognizer)
+    model.eval()
+    image = torch.zeros(1, 1, RECOGNIZER_HEIGHT, 256)
+    text = torch.zeros(1, RECOGNIZER_MAX_LENGTH, dtype=torch.long)
+    torch.onnx.export(model, (image, text), path, input_names=['image', 'text'], output_names=['preds'],
+                      dynamic_axes={'image': {0: 'batch', 3: 'width'}, 'text': {0: 'batch'}, 'preds': {0: 'batch', 1: 'steps'}},
+                      opset_version=13)
+
+
+EXPORTERS = {'emotion': export_emotion, 'ocr': export_recognizer}
+
+
+def network_name(kind, target):
+    """Cache file name of a network: easyocr picks its recognizer weights by language group and generation."""
+    if kind == 'ocr':
+        return f"ocr_{getattr(target, 'model_lang', 'unknown')}_{getattr(target, 'recog_network', 'standard')}"
+    return kind
+
+
+def default_runtime(kind, target):
+    """What the default backend actually runs, for labelling comparisons."""
+    if kind == 'emotion':
+        return 'keras float32'
+    # easyocr.Reader(quantize=True), its default, dynamically quantizes the recognizer when it runs on CPU
+    if getattr(target, 'quantize', True) and str(getattr(target, 'device', 'cpu')) == 'cpu':
+        return 'pytorch dynamic int8'
+    return 'pytorch float32'
+
+
+def quantize(path, quantized_path):
+    """int8 weights with activations quantized on the fly; needs no calibration images."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+
+
+def write_once(path, write):
+    """Create path with write(temporary_path) unless it exists.
+
+    The file is written under a name of this process and renamed into place,
+    so processes exporting at the same time (server workers preloading the
+    same model) never open each other's half written files.
+    """
+    if os.path.exists(path):
+        return path
+    base, ext = os.path.splitext(path)
+    temporary_path = f'{base}.{os.getpid()}.tmp{ext}'
+    try:
+        write(temporary_path)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    return path
+
+
+def model_path(kind, target, backend, model_dir=MODEL_DIR):
+    """Path of the ONNX model for a backend, exported (and quantized) on first use and reused afterwards."""
+    os.makedirs(model_dir, exist_ok=True)
+    name = network_name(kind, target)
+    path = write_once(os.path.join(model_dir, f'{name}.onnx'), lambda export_path: EXPORTERS[kind](target, export_path))
+    if backend != 'onnx-int8':
+        return path
+    return write_once(os.path.join(model_dir, f'{name}.int8.onnx'), lambda quantized_path: quantize(path, quantized_path))
+
+
+class OnnxModel:
+    """An ONNX Runtime CPU session; 0 threads lets ONNX Runtime choose (one intra-op thread per physical core)."""
+    def __init__(self, path, intra_threads=0, inter_threads=0):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_threads
+        options.inter_op_num_threads = inter_threads
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if inter_threads > 1 else ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.inputs = [model_input.name for model_input in self.session.get_inputs()]
+        self.input_ranks = [len(model_input.shape) for model_input in self.session.get_inputs()]
+
+    def run(self, *arrays):
+        # Inputs the exporter pruned (e.g. the recognizer's unused text) are dropped
+        return self.session.run(None, dict(zip(self.inputs, arrays)))[0]
+
+
+class OnnxEmotionClassifier:
+    """Stands in for FER's Keras classifier: called (or predict-ed) with a face batch, returns the probabilities."""
+    def __init__(self, model, input_shape):
+        self.model = model
+        self.input_shape = input_shape
+
+    def __call__(self, faces, training=False):
+        faces = np.asarray(faces, dtype=np.float32)
+        # fer stacks the gray crops as (faces, 64, 64) and lets Keras add the channel axis; the session needs it spelled out
+        if faces.ndim == self.model.input_ranks[0] - 1:
+            faces = faces[..., None]
+        return self.model.run(faces)
+
+    def predict(self, faces, **kwargs):
+        return self(faces)
+
+
+class OnnxRecognizer:
+    """Stands in for easyocr's recognizer module: takes and returns torch tensors like the network did."""
+    def __init__(self, model):
+        self.model = model
+
+    def eval(self):
+        return self
+
+    def __call__(self, image, text=None):
+        import torch
+        arrays = [image.cpu().numpy()] + ([text.cpu().numpy()] if text is not None else [])
+        return torch.from_numpy(self.model.run(*arrays))
+
+
+def check_emotion(network, replacement, backend):
+    """Make sure the replacement classifies a face crop like the Keras network, in the (faces, 64, 64) layout fer uses."""
+    height, width = network.input_shape[1:3]
+    # A smooth synthetic crop scaled to [-1, 1] like fer's preprocessing
+    face = np.linspace(-1.0, 1.0, height * width, dtype=np.float32).reshape(1, height, width)
+    expected = np.asarray(network(face[..., None]))
+    found = np.asarray(replacement(face))
+    tolerance = 0.1 if backend == 'onnx-int8' else 1e-3
+    if found.shape != expected.shape or float(np.abs(found - expected).max()) > tolerance:
+        raise ValueError(f'{backend} emotion classifier disagrees with the Keras network on a test crop')
+
+
+def backend_options(args):
+    """The backend settings of parsed arguments, small enough to hand to worker processes."""
+    return argparse.Namespace(backend=getattr(args, 'backend', 'default'),
+                              intra_threads=getattr(args, 'intra_threads', 0),
+                              inter_threads=getattr(args, 'inter_threads', 0),
+                              onnx_dir=getattr(args, 'onnx_dir', MODEL_DIR))
+
+
+def use_backend(target, kind, options=None):
+    """Replace the network of a FER detector (kind 'emotion') or easyocr Reader ('ocr') per the backend options.
+
+    The rest of FER and easyocr (face detection, text detection, decoding)
+    keeps running as before and only calls the replacement. Returns the
+    network now in use.
+    """
+    options = backend_options(options)
+    attribute = MODEL_ATTRIBUTES[kind]
+    network = getattr(target, attribute)
+    if options.backend == 'default':
+        return network
+    model = OnnxModel(model_path(kind, target, options.backend, options.onnx_dir), options.intra_threads, options.inter_threads)
+    if kind == 'emotion':
+        replacement = OnnxEmotionClassifier(model, network.input_shape)
+        check_emotion(network, replacement, options.backend)
+    else:
+        replacement = OnnxRecognizer(model)
+    setattr(target, attribute, replacement)
+    return replacement
+
+
+def add_backend_arguments(parser):
+    """Inference backend options of the FER and easyocr scripts."""
+    parser.add_argument('--backend', default='default', choices=BACKENDS,
+                        help='Run the network with its own framework, or exported to ONNX Runtime (optionally int8 quantized)')
+    parser.add_argument('--intra_threads', type=int, default=0, help='ONNX Runtime threads inside one operator (0 picks one per core)')
+    parser.add_argument('--inter_threads', type=int, default=0, help='ONNX Runtime threads running independent operators (0 or 1 runs them in sequence)')
+    parser.add_argument('--onnx_dir', default=MODEL_DIR, help='Where exported models are cached; delete a file to export it again')
+
+
+class TimedModel:
+    """Forwards to a network and adds up the time spent in its forward passes."""
+    def __init__(self, model):
+        self.model = model
+        self.seconds = 0.0
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def timed(self, function, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.calls += 1
+
+    def __call__(self, *args, **kwargs):
+        return self.timed(self.model, args, kwargs)
+
+    def predict(self, *args, **kwargs):
+        return self.timed(self.model.predict, args, kwargs)
+
+
+def load_target(kind):
+    if kind == 'emotion':
+        from fer import FER
+        target = FER(mtcnn=True)
+        return target, target.detect_emotions
+    import easyocr
+    from OCR_Detection import OCREngine
+    target = easyocr.Reader(['en'])
+    return target, OCREngine(target).readtext
+
+
+def emotion_accuracy(reference, results):
+    """Faces given the reference label and the mean absolute difference of the emotion probabilities."""
+    same, errors, faces = 0, [], 0
+    for reference_faces, faces_found in zip(reference, results):
+        faces += len(reference_faces)
+        for expected, found in zip(reference_faces, faces_found):
+            expected, found = expected['emotions'], found['emotions']
+            same += max(expected, key=expected.get) == max(found, key=found.get)
+            errors.extend(abs(expected[emotion] - found.get(emotion, 0.0)) for emotion in expected)
+    return {"label_agreement": round(same / faces, 4) if faces else None,
+            "score_error": round(float(np.mean(errors)), 4) if errors else None}
+
+
+def ocr_accuracy(reference, results):
+    """Text regions read exactly like the reference and the mean character similarity of the texts."""
+    same, similarity, regions = 0, [], 0
+    for reference_regions, regions_found in zip(reference, results):
+        regions += len(reference_regions)
+        for expected, found in zip(reference_regions, regions_found):
+            same += expected[1] == found[1]
+            similarity.append(difflib.SequenceMatcher(None, expected[1], found[1]).ratio())
+    return {"text_agreement": round(same / regions, 4) if regions else None,
+            "text_similarity": round(float(np.mean(similarity)), 4) if similarity else None}
+
+
+def compare(kind, images, backends, options, repeat=1, warmup=1):
+    """Run the sample images through every backend; accuracy is measured against the first one."""
+    target, infer = load_target(kind)
+    attribute = MODEL_ATTRIBUTES[kind]
+    original = getattr(target, attribute)
+    report, reference, reference_ms = [], None, None
+    for backend in backends:
+        # Every backend starts from (and exports) the original network
+        setattr(target, attribute, original)
+        options.backend = backend
+        timed = TimedModel(use_backend(target, kind, options))
+        setattr(target, attribute, timed)
+        for i in range(warmup):
+            infer(images[i % len(images)])
+        timed.seconds, timed.calls = 0.0, 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            results = [infer(image) for image in images]
+        elapsed = time.perf_counter() - start
+        runs = len(images) * repeat
+        model_ms = timed.seconds / runs * 1000.0
+        if reference is None:
+            reference, reference_ms = results, model_ms
+        row = {
+            "backend": backend,
+            # The default OCR baseline is already int8 on CPU, see default_runtime
+            "runtime": RUNTIMES.get(backend) or default_runtime(kind, target),
+            "images": len(images),
+            "pipeline_ms": round(elapsed / runs * 1000.0, 2),
+            "model_ms": round(model_ms, 2),
+            "model_calls": timed.calls,
+            "model_speedup": round(reference_ms / model_ms, 2) if model_ms else None,
+        }
+        row.update((emotion_accuracy if kind == 'emotion' else ocr_accuracy)(reference, results))
+        report.append(row)
+    setattr(target, attribute, original)
+    return report
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the accuracy and CPU speed of the FER / easyocr inference backends')
+    parser.add_argument('-m', '--model', default='emotion', choices=list(MODEL_ATTRIBUTES), help='Network to compare')
+    parser.add_argument('-i', '--input', required=True, help='Sample image, or a directory, glob or manifest file of images')
+    parser.add_argument('-b', '--backends', default=','.join(BACKENDS),
+                        help='Comma separated backends; accuracy is relative to the first one')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='Passes over the sample images')
+    parser.add_argument('-w', '--warmup', type=int, default=1, help='Untimed images per backend before measuring')
+    parser.add_argument('-o', '--output', help='Write the report as JSON to this file')
+    parser.add_argument('--intra_threads', type=int, default=0, help='ONNX Runtime threads inside one operator (0 picks one per core)')
+    parser.add_argument('--inter_threads', type=int, default=0, help='ONNX Runtime threads running independent operators')
+    parser.add_argument('--onnx_dir', default=MODEL_DIR, help='Where exported models are cached')
+    args = parser.parse_args(argv)
+
+    backends = [backend for backend in args.backends.split(',') if backend]
+    unknown = [backend for backend in backends if backend not in BACKENDS]
+    if unknown:
+        parser.error(f'unknown backends: {", ".join(unknown)}')
+    paths = expand_inputs(args.input) if is_batch_input(args.input) else [args.input]
+    images = [image for image in (cv2.imread(path) for path in paths) if image is not None]
+    if not images:
+        parser.error(f'no readable images in {args.input}')
+
+    report = compare(args.model, images, backends, backend_options(args), args.repeat, args.warmup)
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump({"model": args.model, "intra_threads": args.intra_threads, "inter_threads": args.inter_threads,
+                       "results": report}, report_file, indent=4)
+
+
+if __name__ == "__main__":
+    cli()
@@ -2,34 +2,146 @@ import cv2
 import argparse
 import os
 import json
-from pyzbar.pyzbar import decode
-
-def detect_and_decode_codes(input_path, output_path=None, no_image=False, json_output=False, play=False):
-    if input_path.endswith('.mp4') or input_path.endswith('.avi'):
-        cap = cv2.VideoCapture(input_path)
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            process_frame(frame, output_path, no_image, json_output, play)
-            if play:
-                cv2.imshow('QR and Barcode Decoder', frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
-        cap.release()
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from BatchInput import is_batch_input, run_batch
+from VideoPipeline import FramePipeline, is_live_source
+from ResultsSink import JsonLinesSink
+from VideoSink import add_video_arguments, open_video_writer, is_video_path
+
+def detect_and_decode_codes(input_path, output_path=None, no_image=False, json_output=False, play=False, workers=4,
+                            scale=1.0, full_scan_every=15, change_threshold=2.0, decoder=None, video_options=None):
+    if is_batch_input(input_path):
+        # output_path is the output directory, results of every image go to one results.jsonl
+        run_batch(input_path, lambda image: annotate_codes(image, decoder), output_path, workers, save_images=not no_image)
+        return
+    if input_path.endswith('.mp4') or input_path.endswith('.avi') or is_live_source(input_path):
+        tracker = CodeTracker(scale, full_scan_every, change_threshold, decoder=decoder)
+        process_video(input_path, tracker, output_path, no_image, json_output, play, video_options)
     else:
         image = cv2.imread(input_path)
-        process_frame(image, output_path, no_image, json_output, play)
+        process_frame(image, output_path, no_image, json_output, play, decoder)
         if play:
             cv2.imshow('QR and Barcode Decoder', image)
             cv2.waitKey(0)
     cv2.destroyAllWindows()
 
-def process_frame(image, output_path, no_image, json_output, play):
-    codes = decode(image)
-    Count_Detect = 0
+def decode(image):
+    """pyzbar's decode, imported on the first call so the module loads without the zbar library."""
+    from pyzbar.pyzbar import decode as zbar_decode
+    return zbar_decode(image)
+
+def describe_code(code, number):
+    """Convert one pyzbar result into the TM vision output format."""
+    # Assuming some default values for score and rotation as they are not provided in the original code
+    return {
+        "Number": number,
+        "box_cx": code.rect[0] + code.rect[2] // 2,
+        "box_cy": code.rect[1] + code.rect[3] // 2,
+        "box_w": code.rect[2],
+        "box_h": code.rect[3],
+        "label": code.data.decode('utf-8'),
+        "score": 0.99,  # Default value
+        "rotation": 0.0  # Default value
+    }
+
+def decode_codes(image, decoder=None):
+    """Decode every code in the image and return the outputs without drawing anything."""
+    codes = decoder.decode(image) if decoder else decode(image)
+    return [describe_code(code, number) for number, code in enumerate(codes, start=1)]
+
+def annotate_codes(image, decoder=None):
+    """Decode every code, draw it on the image and return the outputs."""
+    return draw_codes(image, decoder.decode(image) if decoder else decode(image))
+
+def map_code(code, matrix):
+    """Map a code found on a transformed copy back to the original image with the 2x3 affine matrix."""
+    from pyzbar.locations import Rect, Point
+    points = np.array(code.polygon or [(code.rect.left, code.rect.top), (code.rect.left + code.rect.width, code.rect.top + code.rect.height)],
+                      dtype=np.float64)
+    mapped = np.rint(points @ matrix[:, :2].T + matrix[:, 2]).astype(np.int32)
+    return code._replace(rect=Rect(*cv2.boundingRect(mapped)), polygon=[Point(int(x), int(y)) for x, y in mapped])
+
+class ParallelDecoder:
+    """Runs pyzbar on several preprocessed variants and tiles of an image at once.
+
+    Variants are 'gray', 'threshold' (adaptive), 'scaled' (by scale_factor)
+    and 'rotated' (by 45 degrees, for 1D barcodes at an angle); with tiles > 1
+    the gray image is also decoded as a tiles x tiles grid of overlapping
+    tiles. The jobs, preprocessing included, run on a thread pool (zbar and
+    OpenCV release the GIL), results are mapped back to the original image and
+    deduplicated by data and position, then sorted by position (top, then
+    left) so the order is stable from run to run. With expected_codes set, the jobs that
+    haven't started are cancelled once that many codes are found; the default
+    of 0 runs them all, so labels with several codes keep every one.
+    """
+    VARIANTS = ('gray', 'threshold', 'scaled', 'rotated')
+
+    def __init__(self, variants=VARIANTS, tiles=1, workers=4, expected_codes=0, scale_factor=2.0):
+        unknown = set(variants) - set(self.VARIANTS)
+        if unknown:
+            raise ValueError(f'unknown decode variants: {", ".join(sorted(unknown))}')
+        self.variants = variants
+        self.tiles = tiles
+        self.expected_codes = expected_codes
+        self.scale_factor = scale_factor
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='zbar')
+
+    def jobs(self, gray):
+        """Yield (function preparing the image to decode, matrix mapping its coordinates back to gray),
+        cheapest and most likely first. The preparation runs on the pool with the decode."""
+        identity = np.float64([[1, 0, 0], [0, 1, 0]])
+        if 'gray' in self.variants:
+            yield lambda: gray, identity
+        if 'threshold' in self.variants:
+            yield lambda: cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10), identity
+        if 'scaled' in self.variants:
+            yield lambda: cv2.resize(gray, None, fx=self.scale_factor, fy=self.scale_factor,
+                                     interpolation=cv2.INTER_CUBIC if self.scale_factor > 1 else cv2.INTER_AREA), \
+                identity / self.scale_factor
+        if 'rotated' in self.variants:
+            height, width = gray.shape
+            matrix = cv2.getRotationMatrix2D((width / 2.0, height / 2.0), 45, 1.0)
+            side = int((width + height) / np.sqrt(2)) + 1
+            matrix[:, 2] += (side / 2.0 - width / 2.0, side / 2.0 - height / 2.0)
+            yield lambda: cv2.warpAffine(gray, matrix, (side, side), borderValue=255), cv2.invertAffineTransform(matrix)
+        if self.tiles > 1:
+            height, width = gray.shape
+            tile_h, tile_w = int(height / self.tiles * 1.2), int(width / self.tiles * 1.2)
+            for row in range(self.tiles):
+                for col in range(self.tiles):
+                    y0 = min(row * height // self.tiles, height - tile_h)
+                    x0 = min(col * width // self.tiles, width - tile_w)
+                    tile = gray[y0:y0 + tile_h, x0:x0 + tile_w]
+                    yield lambda tile=tile: tile, np.float64([[1, 0, x0], [0, 1, y0]])
+
+    def decode(self, image):
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        futures = [self.executor.submit(lambda prepare, matrix: [map_code(code, matrix) for code in decode(prepare())], prepare, matrix)
+                   for prepare, matrix in self.jobs(gray)]
+        found = []
+        # Without early stopping every job runs anyway, so take them in submission order: the same frame then
+        # always keeps the same copy of each code
+        for future in as_completed(futures) if self.expected_codes else futures:
+            for code in future.result():
+                cx, cy = code_center(code)
+                if not any(other.data == code.data and abs(code_center(other)[0] - cx) < max(other.rect.width, 8) / 2
+                           and abs(code_center(other)[1] - cy) < max(other.rect.height, 8) / 2 for other in found):
+                    found.append(code)
+            if self.expected_codes and len(found) >= self.expected_codes:
+                for pending in futures:
+                    pending.cancel()
+                break
+        # Top to bottom, then left to right, so numbering doesn't depend on which thread finished first
+        return sorted(found, key=lambda code: (code.rect.top, code.rect.left))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+def draw_codes(image, codes):
+    """Draw decoded codes on the image and return their outputs."""
     outputs = []
-    for code in codes:
+    for number, code in enumerate(codes, start=1):
         if len(code.polygon) == 4:
             pts = [tuple(pt) for pt in code.polygon]
             for i in range(4):
@@ -37,22 +149,150 @@ def process_frame(image, output_path, no_image, json_output, play):
         else:
             x, y, w, h = code.rect
             cv2.rectangle(image, (x, y), (x+w, y+h), (0, 255, 0), 2)
-        text = code.data.decode('utf-8')
-        cv2.putText(image, text, (code.rect[0], code.rect[1]-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-        Count_Detect += 1
-        
-        # Assuming some default values for score and rotation as they are not provided in the original code
-        output = {
-            "Number": Count_Detect,
-            "box_cx": code.rect[0] + code.rect[2] // 2,
-            "box_cy": code.rect[1] + code.rect[3] // 2,
-            "box_w": code.rect[2],
-            "box_h": code.rect[3],
-            "label": text,
-            "score": 0.99,  # Default value
-            "rotation": 0.0  # Default value
-        }
+        output = describe_code(code, number)
+        cv2.putText(image, output["label"], (code.rect[0], code.rect[1]-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
         outputs.append(output)
+    return outputs
+
+def code_center(code):
+    return code.rect.left + code.rect.width / 2.0, code.rect.top + code.rect.height / 2.0
+
+def translate_code(code, x0, y0, scale):
+    """Map a code decoded on a (cropped, scaled) copy back to full frame coordinates."""
+    left, top, width, height = code.rect
+    return code._replace(
+        rect=code.rect._make((int((left + x0) / scale), int((top + y0) / scale), int(width / scale), int(height / scale))),
+        polygon=[point._make((int((point.x + x0) / scale), int((point.y + y0) / scale))) for point in code.polygon])
+
+class CodeTracker:
+    """Decodes codes in a video without scanning every full frame.
+
+    Frames are decoded in grayscale, downscaled by scale. A frame whose 64 px
+    wide thumbnail differs from the last decoded one by less than
+    change_threshold gray levels on average is not decoded at all. Between
+    full scans (every full_scan_every decoded frames, or as soon as a code
+    is lost) only the regions around the codes of the previous frame are
+    decoded, grown by margin times the code size to follow moving parts.
+    """
+    def __init__(self, scale=1.0, full_scan_every=15, change_threshold=2.0, margin=0.5, move_threshold=10, decoder=None):
+        self.scale = scale
+        # Full scans go through the ParallelDecoder when one is given
+        self.decode = decoder.decode if decoder else decode
+        self.full_scan_every = full_scan_every
+        self.change_threshold = change_threshold
+        self.margin = margin
+        self.move_threshold = move_threshold
+        self.codes = []
+        self.thumbnail = None
+        self.since_full_scan = 0
+        # (type, data) -> center of every code reported so far and still in view
+        self.reported = {}
+        self.stats = {"frames": 0, "skipped": 0, "full_scans": 0, "region_scans": 0}
+
+    def update(self, frame):
+        """Return the codes in the frame, in full frame coordinates."""
+        self.stats["frames"] += 1
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        height, width = gray.shape
+        thumbnail = cv2.resize(gray, (64, max(1, 64 * height // width)), interpolation=cv2.INTER_AREA)
+        if (self.thumbnail is not None and self.change_threshold > 0
+                and cv2.absdiff(thumbnail, self.thumbnail).mean() < self.change_threshold):
+            self.stats["skipped"] += 1
+            return self.codes
+        self.thumbnail = thumbnail
+
+        small = gray if self.scale == 1.0 else cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        codes = None
+        if self.codes and self.since_full_scan < self.full_scan_every:
+            self.since_full_scan += 1
+            self.stats["region_scans"] += 1
+            codes = self.scan_regions(small)
+            if len(codes) < len(self.codes):
+                codes = None
+        if codes is None:
+            self.since_full_scan = 0
+            self.stats["full_scans"] += 1
+            codes = [translate_code(code, 0, 0, self.scale) for code in self.decode(small)]
+        self.codes = codes
+        return codes
+
+    def scan_regions(self, small):
+        height, width = small.shape
+        found = []
+        for previous in self.codes:
+            left, top, w, h = (v * self.scale for v in previous.rect)
+            grow = self.margin * max(w, h)
+            x0, y0 = max(0, int(left - grow)), max(0, int(top - grow))
+            x1, y1 = min(width, int(left + w + grow) + 1), min(height, int(top + h + grow) + 1)
+            for code in decode(small[y0:y1, x0:x1]):
+                code = translate_code(code, x0, y0, self.scale)
+                cx, cy = code_center(code)
+                # Regions of neighbouring codes overlap, keep each code once
+                if not any(other.data == code.data and abs(code_center(other)[0] - cx) < 10 and abs(code_center(other)[1] - cy) < 10
+                           for other in found):
+                    found.append(code)
+        return found
+
+    def events(self, codes):
+        """Codes that appeared, moved more than move_threshold pixels or disappeared since the last call."""
+        events = []
+        current = {}
+        for number, code in enumerate(codes, start=1):
+            key = (code.type, code.data)
+            center = code_center(code)
+            current[key] = center
+            previous = self.reported.get(key)
+            if previous is None:
+                events.append(("new", describe_code(code, number)))
+            elif max(abs(center[0] - previous[0]), abs(center[1] - previous[1])) > self.move_threshold:
+                events.append(("moved", describe_code(code, number)))
+            else:
+                current[key] = previous
+        for key in self.reported:
+            if key not in current:
+                events.append(("lost", {"label": key[1].decode('utf-8'), "type": key[0]}))
+        self.reported = current
+        return events
+
+def process_video(input_path, tracker, output_path, no_image, json_output, play, video_options=None):
+    """Follow codes through a video or camera; with json_output every new, moved or lost code is one line of output_path.jsonl.
+
+    An output_path with a video extension gets the annotated video, otherwise the last annotated frame is saved.
+    """
+    cap = cv2.VideoCapture(int(input_path) if input_path.isdigit() else input_path)
+    live = is_live_source(input_path)
+    sink = JsonLinesSink(output_path + '.jsonl') if json_output else None
+    out = open_video_writer(output_path, cap, live, video_options) if is_video_path(output_path) and not no_image else None
+    frame_index = -1
+    frame = None
+    try:
+        with FramePipeline(cap, tracker.update, live) as pipeline:
+            for frame, codes in pipeline:
+                frame_index += 1
+                if sink is not None:
+                    for event, output in tracker.events(codes):
+                        sink.write(dict(output, frame=frame_index, event=event))
+                if play or not no_image:
+                    draw_codes(frame, codes)
+                if out is not None:
+                    out.write(frame)
+                if play:
+                    cv2.imshow('QR and Barcode Decoder', frame)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+    finally:
+        cap.release()
+        if sink is not None:
+            sink.close()
+        if out is not None:
+            out.close()
+    # One annotated image of the last frame instead of rewriting it on every frame
+    if frame is not None and not no_image and out is None:
+        cv2.imwrite(output_path, frame)
+    print(json.dumps(tracker.stats))
+
+def process_frame(image, output_path, no_image, json_output, play, decoder=None):
+    outputs = annotate_codes(image, decoder)
 
     if json_output:
         with open(output_path + '.json', 'w') as f:
@@ -61,19 +301,39 @@ def process_frame(image, output_path, no_image, json_output, play):
     if not no_image:
         cv2.imwrite(output_path, image)
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description='QR and Barcode Decoder')
-    parser.add_argument('-i', '--input', required=True, help='Path to the input image or video')
+    parser.add_argument('-i', '--input', required=True, help='Path to the input image or video, or a directory, glob or manifest file of images')
     parser.add_argument('-o', '--output', required=True, help='Path to the output image or directory')
     parser.add_argument('-n', '--no_image', action='store_true', help='Skip saving the image')
     parser.add_argument('-j', '--json', action='store_true', help='Output the results as a JSON file')
     parser.add_argument('-p', '--play', action='store_true', help='Display the image or video')
+    parser.add_argument('--workers', type=int, default=4, help='Threads reading and writing images in batch mode')
+    parser.add_argument('--scale', type=float, default=1.0, help='Decode video frames downscaled by this factor')
+    parser.add_argument('--full_scan_every', type=int, default=15,
+                        help='In video mode, decode the whole frame every N decoded frames and only around known codes in between')
+    parser.add_argument('--change_threshold', type=float, default=2.0,
+                        help='Skip video frames whose mean gray level change is below this (0 decodes every frame)')
+    parser.add_argument('--variants', default='',
+                        help=f"Comma separated preprocessing variants decoded in parallel ({', '.join(ParallelDecoder.VARIANTS)}); empty decodes the image once")
+    parser.add_argument('--tiles', type=int, default=1, help='Also decode an NxN grid of overlapping tiles in parallel')
+    parser.add_argument('--decode_workers', type=int, default=4, help='Threads decoding variants and tiles')
+    parser.add_argument('--expected_codes', type=int, default=0,
+                        help='Stop trying variants once this many codes are found (0, the default, always tries them all)')
+    add_video_arguments(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Create directory if it doesn't exist
     output_dir = os.path.dirname(args.output)
-    if not os.path.exists(output_dir):
+    if output_dir and not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    detect_and_decode_codes(args.input, args.output, args.no_image, args.json, args.play)
+    variants = tuple(v for v in args.variants.split(',') if v)
+    decoder = ParallelDecoder(variants or ('gray',), args.tiles, args.decode_workers, args.expected_codes) if variants or args.tiles > 1 else None
+
+    detect_and_decode_codes(args.input, args.output, args.no_image, args.json, args.play, args.workers,
+                            args.scale, args.full_scan_every, args.change_threshold, decoder, args)
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,95 @@
+import os
+import threading
+import datetime
+import itertools
+from collections import deque
+import cv2
+
+
+class ResultArchiver:
+    """Writes request images to disk from a background thread.
+
+    enqueue() never blocks: images wait in a bounded deque and, when the
+    writer falls behind, the oldest pending image is dropped to make room.
+    Every image gets its own timestamped name instead of overwriting one file.
+    Images that can't be decoded or written are counted in failed, queue
+    overflow in dropped; either way the writer thread keeps going.
+    """
+    def __init__(self, root='Output', image_format='png', quality=90, sample_every=1, max_pending=32):
+        self.root = root
+        self.image_format = image_format.lower().lstrip('.')
+        if self.image_format in ('jpg', 'jpeg'):
+            self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif self.image_format == 'png':
+            # The archive is for traceability, level 1 encodes much faster than OpenCV's default of 3
+            self.encode_params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+        else:
+            self.encode_params = []
+        self.sample_every = sample_every
+        self.pending = deque(maxlen=max_pending)
+        self.condition = threading.Condition()
+        self.counter = itertools.count()
+        self.created_folders = set()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        # Images queued or being written, like queue.Queue's unfinished tasks
+        self.unfinished = 0
+        self.worker = threading.Thread(target=self.run, name='archiver', daemon=True)
+        self.worker.start()
+
+    def enqueue(self, method, model_id, image):
+        """Queue an image for writing and return the path it will be saved to, or None if it is not sampled.
+
+        image may also be a callable returning it, then called on the writer thread.
+        """
+        number = next(self.counter)
+        if self.sample_every <= 0 or number % self.sample_every:
+            return None
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        path = os.path.join(self.root, method, f'{timestamp}_{model_id}_{number:06d}.{self.image_format}')
+        with self.condition:
+            if len(self.pending) == self.pending.maxlen:
+                # The deque pushes out the oldest image, which is then never written
+                self.dropped += 1
+            else:
+                self.unfinished += 1
+            self.pending.append((path, image))
+            self.condition.notify()
+        return path
+
+    def depth(self):
+        return len(self.pending)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                path, image = self.pending.popleft()
+            try:
+                self.write(path, image)
+            finally:
+                with self.condition:
+                    self.unfinished -= 1
+                    self.condition.notify_all()
+
+    def write(self, path, image):
+        try:
+            folder = os.path.dirname(path)
+            if folder not in self.created_folders:
+                os.makedirs(folder, exist_ok=True)
+                self.created_folders.add(folder)
+            if callable(image):
+                image = image()
+            if not cv2.imwrite(path, image, self.encode_params):
+                raise OSError(f'cannot write {path}')
+            self.written += 1
+        except (cv2.error, ValueError, OSError):
+            # Permissions, a full disk or an undecodable upload lose this image only
+            self.failed += 1
+
+    def flush(self, timeout=5.0):
+        """Wait until every queued image has been written, used on shutdown and in benchmarks."""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.unfinished == 0, timeout)
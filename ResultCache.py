@@ -0,0 +1,87 @@
+import threading
+import time
+import hashlib
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+
+def average_hash(image, hash_size=16):
+    """Perceptual hash: one bit per cell of a hash_size x hash_size gray thumbnail, set where it is brighter than the mean."""
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY if image.shape[2] == 3 else cv2.COLOR_BGRA2GRAY)
+    small = cv2.resize(gray, (hash_size, hash_size), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small > small.mean())
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+class ResultCache:
+    """LRU cache of inference results for repeated frames, keyed by model_id and image content.
+
+    With tolerance=None the key is a blake2b digest of the uploaded bytes, so
+    a repeated upload hits before it is even decoded. With a tolerance the key
+    is an average hash of a small preview of the image and the closest cached
+    frame of the same model_id within that many differing bits is a hit, which
+    also catches sensor noise and recompression. Entries older than ttl seconds
+    are never returned.
+    """
+    def __init__(self, max_entries=256, ttl=10.0, tolerance=None, hash_size=16):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.tolerance = tolerance
+        self.hash_size = hash_size
+        # key -> (expiry, result), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, model_id, data, preview=None, shape=None):
+        """Key of an upload: data are its bytes (encoded or raw pixels, then with their shape),
+        preview a callable returning a downscaled image, only called with a tolerance."""
+        if self.tolerance is None:
+            digest = hashlib.blake2b(data, digest_size=16)
+            if shape is not None:
+                digest.update(repr(tuple(shape)).encode())
+            return model_id, digest.digest()
+        return model_id, average_hash(preview(), self.hash_size)
+
+    def get(self, key):
+        """Return the cached result for key, or None."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < now:
+                del self.entries[key]
+                entry = None
+            if entry is None and self.tolerance:
+                model_id, image_hash = key
+                best, expired = None, []
+                for other, candidate in self.entries.items():
+                    if candidate[0] < now:
+                        expired.append(other)
+                        continue
+                    if other[0] != model_id:
+                        continue
+                    distance = bin(other[1] ^ image_hash).count('1')
+                    if distance <= self.tolerance and (best is None or distance < best[0]):
+                        best = (distance, other, candidate)
+                for other in expired:
+                    del self.entries[other]
+                if best is not None:
+                    _, key, entry = best
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,59 @@
+import json
+import gzip
+import time
+import cv2
+
+
+def open_text(path, buffer_size):
+    # A .gz path is written gzip compressed; level 1 keeps compression off the critical path
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', compresslevel=1)
+    return open(path, 'w', buffering=buffer_size)
+
+
+class JsonLinesSink:
+    """Appends one JSON record per line through a buffered file handle opened once."""
+    def __init__(self, path, buffer_size=1 << 16):
+        self.path = path
+        self.file = open_text(path, buffer_size)
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')))
+        self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class FrameResultsSink(JsonLinesSink):
+    """Streams the outputs of a video run, one {"frame", "timestamp", "outputs"} line per frame.
+
+    Timestamps are seconds into the video, from the frame index when the
+    source frame rate is known (files) and from the wall clock otherwise
+    (cameras and streams, where frames may be dropped).
+    """
+    def __init__(self, path, fps=0.0, buffer_size=1 << 16):
+        super().__init__(path, buffer_size)
+        self.fps = fps
+        self.start = time.monotonic()
+        self.frames = 0
+
+    def write_frame(self, outputs, frame_index=None):
+        index = self.frames if frame_index is None else frame_index
+        timestamp = index / self.fps if self.fps > 0 else time.monotonic() - self.start
+        self.write({"frame": index, "timestamp": round(timestamp, 3), "outputs": outputs})
+        self.frames = index + 1
+
+
+def video_results_sink(path, cap, live, compress=False):
+    """FrameResultsSink for a capture, timestamped by its frame rate unless the source is live."""
+    if compress and not path.endswith('.gz'):
+        path += '.gz'
+    return FrameResultsSink(path, 0.0 if live else cap.get(cv2.CAP_PROP_FPS))
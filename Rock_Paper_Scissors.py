@@ -1,36 +1,37 @@
 import cv2
-import mediapipe as mp
 import argparse
 import os
 import json
+from HandTracking import hands_from_options, add_adaptive_arguments, report_model_rate
+from VideoPipeline import is_live_source
+from HandLandmarks import hands_to_array, rps_labels
+from ResultsSink import video_results_sink
+from VideoSink import add_video_arguments, open_video_writer, is_video_path
 
 class GestureGame:
-    def __init__(self, args):
+    def __init__(self, args, capture=True):
         self.args = args
-        if args.input:
+        if not capture:
+            # Frames are handed to process_image by the caller (e.g. the HTTP server)
+            self.cap = None
+        elif args.input:
             self.cap = cv2.VideoCapture(args.input)
         else:
             self.cap = cv2.VideoCapture(0)
+        # Imported on first use so the module (and its --help) loads without mediapipe
+        import mediapipe as mp
         self.mp_hands = mp.solutions.hands
-        self.hands = self.mp_hands.Hands()
+        self.hands = hands_from_options(self.mp_hands, not self.is_image(), getattr(args, 'max_hands', 2), args)
         self.mp_draw = mp.solutions.drawing_utils
 
-    def detect_gesture(self, landmarks):
-        # Check for Rock (Hammer)
-        if (landmarks[8].y > landmarks[6].y) and (landmarks[12].y > landmarks[10].y) and (landmarks[16].y > landmarks[14].y) and (landmarks[20].y > landmarks[18].y):
-            return "Rock (Hammer)"
-        
-        # Check for Scissors
-        if (landmarks[8].y < landmarks[6].y) and (landmarks[12].y < landmarks[10].y) and (landmarks[16].y > landmarks[14].y) and (landmarks[20].y > landmarks[18].y):
-            return "Scissors"
-        
-        # Check for Paper
-        if (landmarks[8].y < landmarks[6].y) and (landmarks[12].y < landmarks[10].y) and (landmarks[16].y < landmarks[14].y) and (landmarks[20].y < landmarks[18].y):
-            return "Paper"
-        
-        return None
+    def is_image(self):
+        return bool(self.args.input) and self.args.input.split('.')[-1] in ['jpg', 'jpeg', 'png']
 
     def process_image(self, frame):
+        return self.analyze_image(frame)[0]
+
+    def analyze_image(self, frame):
+        """Draw the detected gestures on the frame and return it with the frame's JSON output."""
         # Convert the BGR image to RGB
         rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         
@@ -41,29 +42,28 @@ class GestureGame:
         
         # If hand landmarks are found, draw them and detect gesture
         if results.multi_hand_landmarks:
-            for hand_landmarks in results.multi_hand_landmarks:
+            gestures = rps_labels(hands_to_array(results.multi_hand_landmarks))
+            for hand_landmarks, hand_info, gesture in zip(results.multi_hand_landmarks, results.multi_handedness, gestures):
                 self.mp_draw.draw_landmarks(frame, hand_landmarks, self.mp_hands.HAND_CONNECTIONS)
-                gesture = self.detect_gesture(hand_landmarks.landmark)
                 
                 # Check if the hand is left or right
-                handedness = "Left" if hand_landmarks.classification[0].label == "Left" else "Right"
+                handedness = "Left" if hand_info.classification[0].label == "Left" else "Right"
                 
                 if gesture:
                     cv2.putText(frame, f"{handedness} Hand: {gesture}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2, cv2.LINE_AA)
                     json_output["hands"].append({"handedness": handedness, "gesture": gesture})
         
-        # Save to JSON file if the --json argument is provided
-        if self.args.json:
-            with open('Rock_Paper_Scissors.json', 'w') as json_file:
-                json.dump(json_output, json_file, indent=4)
-        
-        return frame
+        return frame, json_output
 
     def run(self):
-        if self.args.input and self.args.input.split('.')[-1] in ['jpg', 'jpeg', 'png']:
+        if self.is_image():
             # Process a single image
             ret, frame = self.cap.read()
-            processed_frame = self.process_image(frame)
+            processed_frame, json_output = self.analyze_image(frame)
+            # Save to JSON file if the --json argument is provided
+            if self.args.json:
+                with open('Rock_Paper_Scissors.json', 'w') as json_file:
+                    json.dump(json_output, json_file, indent=4)
             if self.args.output:
                 directory = os.path.dirname(self.args.output)
                 if not os.path.exists(directory):
@@ -73,28 +73,54 @@ class GestureGame:
                 cv2.imshow('Rock Paper Scissors Game', processed_frame)
                 cv2.waitKey(0)
         else:
-            # Process video
-            while True:
-                ret, frame = self.cap.read()
-                if not ret:
-                    break
-                processed_frame = self.process_image(frame)
-                if self.args.play:
-                    cv2.imshow('Rock Paper Scissors Game', processed_frame)
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
+            # Process video, streaming one JSON line per frame instead of rewriting the file
+            live = is_live_source(self.args.input)
+            sink = None
+            if self.args.json:
+                sink = video_results_sink('Rock_Paper_Scissors.jsonl', self.cap, live, getattr(self.args, 'compress', False))
+            out = None
+            if is_video_path(self.args.output) and not self.args.no_image:
+                # Encoding runs on the writer's thread instead of in this loop
+                out = open_video_writer(self.args.output, self.cap, live, self.args)
+            try:
+                while True:
+                    ret, frame = self.cap.read()
+                    if not ret:
                         break
+                    processed_frame, json_output = self.analyze_image(frame)
+                    if sink is not None:
+                        sink.write_frame(json_output["hands"])
+                    if out is not None:
+                        out.write(processed_frame)
+                    if self.args.play:
+                        cv2.imshow('Rock Paper Scissors Game', processed_frame)
+                        if cv2.waitKey(1) & 0xFF == ord('q'):
+                            break
+            finally:
+                if sink is not None:
+                    sink.close()
+                if out is not None:
+                    out.close()
+                report_model_rate(self.hands)
 
         self.cap.release()
         cv2.destroyAllWindows()
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description='Rock Paper Scissors Game with gestures.')
     parser.add_argument('-i', '--input', help='Path to the input image or video.')
     parser.add_argument('-o', '--output', help='Path to save the output image or video.')
     parser.add_argument('-n', '--no_image', action='store_true', help='Skip removing the image.')
     parser.add_argument('-j', '--json', action='store_true', help='Output the predicted parameter values as a Json file.')
     parser.add_argument('-p', '--play', action='store_true', help='Display the processed image or video.')
-    args = parser.parse_args()
+    parser.add_argument('-z', '--compress', action='store_true', help='Gzip the JSON Lines output of video runs.')
+    parser.add_argument('-m', '--max_hands', type=int, default=2, help='Maximum number of hands to track.')
+    add_video_arguments(parser)
+    add_adaptive_arguments(parser)
+    args = parser.parse_args(argv)
 
     game = GestureGame(args)
     game.run()
+
+if __name__ == "__main__":
+    cli()
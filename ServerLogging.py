@@ -0,0 +1,112 @@
+import sys
+import json
+import queue
+import atexit
+import logging
+import datetime
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# Listener threads to drain and stop at exit so the last records are not lost
+active_listeners = []
+
+
+def stop_listeners():
+    while active_listeners:
+        active_listeners.pop().stop()
+
+
+atexit.register(stop_listeners)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with any fields passed as extra={'fields': {...}} merged in."""
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class TextFormatter(logging.Formatter):
+    """The server's original '[timestamp] message' lines, with extra fields appended as key=value."""
+    def format(self, record):
+        timestamp = datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds")
+        fields = ' '.join(f'{key}={value}' for key, value in getattr(record, 'fields', {}).items())
+        return f'[{timestamp}] {record.getMessage()}' + (f' {fields}' if fields else '')
+
+
+class RequestSampler(logging.Filter):
+    """Lets every record through, except per-request lines once the rate gets high.
+
+    Records logged with extra={'sampled': True} pass freely up to
+    max_per_second; above that only every sample_every-th one is kept until
+    the next second starts (sample_every 0 keeps none of them).
+    """
+    def __init__(self, max_per_second=50, sample_every=10):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self.sample_every = sample_every
+        self.window = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False) or self.max_per_second <= 0:
+            return True
+        with self.lock:
+            window = int(time.monotonic())
+            if window != self.window:
+                self.window = window
+                self.count = 0
+            self.count += 1
+            overflow = self.count - self.max_per_second
+        return overflow <= 0 or (self.sample_every > 0 and overflow % self.sample_every == 0)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the listener thread and never blocks: a full queue drops the record."""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread; the record stays in this process so it needn't be flattened
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(name='tmvision', level='INFO', log_format='json', max_per_second=50, sample_every=10,
+                  stream=None, max_queue=10000):
+    """Route the named logger through a bounded queue to a background thread that formats and writes records."""
+    logger = logging.getLogger(name)
+    for handler in list(logger.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            handler.listener.stop()
+            active_listeners.remove(handler.listener)
+            logger.removeHandler(handler)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+    log_queue = queue.Queue(maxsize=max_queue)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(RequestSampler(max_per_second, sample_every))
+    handler.listener = QueueListener(log_queue, output)
+    handler.listener.start()
+    active_listeners.append(handler.listener)
+
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
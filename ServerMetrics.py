@@ -0,0 +1,112 @@
+import threading
+import bisect
+from collections import defaultdict
+
+# Latency buckets in seconds, from sub-millisecond protocol work up to multi-second OCR passes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, rendered in the Prometheus text format."""
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for label_values, (counts, total, count) in sorted(self.series.items()):
+                labels = dict(zip(self.label_names, label_values))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{format_labels(dict(labels, le=bound))} {cumulative}')
+                lines.append(f'{self.name}_bucket{format_labels(dict(labels, le="+Inf"))} {count}')
+                lines.append(f'{self.name}_sum{format_labels(labels)} {total}')
+                lines.append(f'{self.name}_count{format_labels(labels)} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(dict(zip(self.label_names, label_values)))} {value}')
+        return lines
+
+
+class ServerMetrics:
+    """Request, stage and queue metrics of the HTTP server, exposed on /api/metrics."""
+    def __init__(self):
+        self.requests = Counter('tmvision_requests_total', 'Requests by method, model_id and status',
+                                ('method', 'model_id', 'status'))
+        self.errors = Counter('tmvision_errors_total', 'Requests that failed during processing', ('method', 'model_id'))
+        self.request_seconds = Histogram('tmvision_request_seconds', 'Total time spent handling a request',
+                                         ('method', 'model_id'))
+        self.stage_seconds = Histogram('tmvision_stage_seconds', 'Time spent per request stage',
+                                       ('method', 'stage', 'model_id'))
+        # name -> (help, label name, callable returning {label value: value}, type), sampled when the metrics are rendered
+        self.gauges = {}
+
+    def add_gauge(self, name, help_text, label_name, read):
+        self.gauges[name] = (help_text, label_name, read, 'gauge')
+
+    def add_counter(self, name, help_text, label_name, read):
+        """Like add_gauge, for totals another component keeps that only ever grow."""
+        self.gauges[name] = (help_text, label_name, read, 'counter')
+
+    def record_request(self, method, model_id, status, seconds, stage_times):
+        # HTTP status codes and binary protocol messages share the label, as strings so they sort together
+        self.requests.inc(method, model_id, str(status))
+        self.request_seconds.observe(seconds, method, model_id)
+        for stage, stage_seconds in stage_times.items():
+            self.stage_seconds.observe(stage_seconds, method, stage, model_id)
+
+    def render(self):
+        lines = []
+        for metric in (self.requests, self.errors, self.request_seconds, self.stage_seconds):
+            lines.extend(metric.render())
+        for name, (help_text, label_name, read, kind) in self.gauges.items():
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {kind}'])
+            for label_value, value in sorted(read().items()):
+                lines.append(f'{name}{format_labels({label_name: label_value})} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def server_timing_header(stage_times):
+    """Format stage durations for the Server-Timing response header (milliseconds)."""
+    return ', '.join(f'{stage};dur={seconds * 1000.0:.2f}' for stage, seconds in stage_times.items())
@@ -0,0 +1,45 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import numpy as np
+
+
+def latency_summary(seconds):
+    """p50/p95/p99 and mean of a list of durations, in milliseconds."""
+    values = np.asarray(seconds, dtype=np.float64) * 1000.0
+    if values.size == 0:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+
+class StageTimer:
+    """Collects wall-clock durations per named stage.
+
+        timer = StageTimer()
+        with timer.stage('decode'):
+            img = cv2.imdecode(...)
+        timer.summary()  # {'decode': {'p50_ms': ..., ...}}
+    """
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def summary(self):
+        return {name: latency_summary(values) for name, values in self.samples.items()}
@@ -3,18 +3,58 @@ from werkzeug.exceptions import HTTPException
 from waitress import serve
 import cv2
 import numpy as np
-import datetime
+import time
+import math
+import logging
 import socket
-import os
+import argparse
+from contextlib import contextmanager
+from ModelRegistry import ModelRegistry, MODEL_LOADERS, backend_loaders, classify
+from OnnxBackend import BACKENDS, MODEL_DIR, backend_options
+from InferenceScheduler import InferenceScheduler
+from WorkerPool import WorkerPool
+from ResultArchiver import ResultArchiver
+from ServerMetrics import ServerMetrics, server_timing_header
+from ServerLogging import setup_logging
+from BinaryProtocol import BinaryServer
+from ResultCache import ResultCache
 
 app = Flask(__name__)
 HOST_NAME = 'TM Vision HTTP Server'
 HOST_PORT = 4585
+BINARY_PORT = 4586
 
-# Utility function to log with timestamp
-def log_message(message):
-    timestamp = datetime.datetime.now().isoformat(timespec="milliseconds")
-    print(f'[{timestamp}] {message}')
+# Warm models shared by every request, keyed by model_id; cli() replaces it (None when worker processes hold the models)
+registry = ModelRegistry()
+# Backend the routes call into, swapped for an InferenceScheduler when batching is enabled
+inference = registry
+# Request images are saved off the request path; created in cli() so importing this module starts no thread (None disables)
+archiver = None
+# Results of recently seen frames, set from --cache-size (None disables)
+cache = None
+# Per-request stage histograms and counters served on /api/metrics
+metrics = ServerMetrics()
+metrics.add_gauge('tmvision_archive_queue_depth', 'Images waiting to be archived', 'queue',
+                  lambda: {'archive': archiver.depth()} if archiver else {})
+metrics.add_counter('tmvision_archive_dropped_total', 'Archive images dropped under backpressure', 'queue',
+                    lambda: {'archive': archiver.dropped} if archiver else {})
+metrics.add_counter('tmvision_archive_failed_total', 'Archive images that could not be decoded or written', 'queue',
+                    lambda: {'archive': archiver.failed} if archiver else {})
+metrics.add_gauge('tmvision_batch_queue_depth', 'Requests waiting for a micro-batch per model_id', 'model_id',
+                  lambda: inference.queue_depths() if hasattr(inference, 'queue_depths') else {})
+metrics.add_counter('tmvision_cache_lookups_total', 'Result cache lookups by outcome', 'result',
+                    lambda: {'hit': cache.hits, 'miss': cache.misses} if cache else {})
+metrics.add_gauge('tmvision_cache_entries', 'Results held in the cache', 'cache', lambda: {'result': len(cache)} if cache else {})
+# Set from --server-timing, adds the stage durations to every response as a Server-Timing header
+SERVER_TIMING = False
+
+# Records are formatted and written by a background thread; reconfigured in __main__ from the command line options
+logger = setup_logging()
+
+# Utility function to log with timestamp (added by the logging thread)
+def log_message(message, level=logging.INFO, sampled=False, **fields):
+    '''Queue a log record. sampled=True marks per-request lines that may be thinned out under high load.'''
+    logger.log(level, message, extra={'sampled': sampled, 'fields': fields})
 
 # Error handler for HTTP exceptions
 @app.errorhandler(HTTPException)
@@ -27,15 +67,150 @@ def handle_exception(e):
 @app.before_request
 def before_request():
     # Replacing 'request.remote_port' with a placeholder 'PORT'
-    log_message(f'[{request.remote_addr}:PORT] -> {request.method}({request.path}) - Start')
-    g.request_start_time = datetime.datetime.utcnow()
+    log_message(f'[{request.remote_addr}:PORT] -> {request.method}({request.path}) - Start', logging.DEBUG, sampled=True)
+    g.request_start_time = time.perf_counter()
+    g.stage_times = {}
+
+def method_label(m_method, prefix=''):
+    '''Metric label of a request method: CLS or DET (BIN CLS, BIN DET with prefix 'BIN '), anything else is other.'''
+    return prefix + m_method if m_method in ('CLS', 'DET') else 'other'
+
+def model_label(model_id):
+    '''Metric label of a model_id: the id when it is known, unknown otherwise and - when it is missing.'''
+    if model_id is None:
+        return '-'
+    return model_id if inference.is_known(model_id) else 'unknown'
+
+def metric_labels():
+    '''Method and model_id labels of the current request, bounded so clients can't create new series at will.'''
+    m_method = request.view_args.get('m_method') if request.method == 'POST' and request.view_args else None
+    return method_label(m_method), model_label(request.args.get('model_id'))
 
 @app.after_request
 def after_request(response):
     try:
-        log_message(f'[{request.remote_addr}:{request.environ.get("REMOTE_PORT")}] -> {request.method}({request.path}) - End')
+        elapsed = time.perf_counter() - g.request_start_time
+        metrics.record_request(*metric_labels(), response.status_code, elapsed, g.stage_times)
+        if SERVER_TIMING:
+            response.headers['Server-Timing'] = server_timing_header(dict(g.stage_times, total=elapsed))
+        log_message(f'[{request.remote_addr}:{request.environ.get("REMOTE_PORT")}] -> {request.method}({request.path}) - End',
+                    sampled=True, status=response.status_code, model_id=request.args.get('model_id'),
+                    duration_ms=round(elapsed * 1000.0, 2))
     except Exception as e:
-        log_message(f"Error logging after request: {str(e)}")
+        log_message(f"Error logging after request: {str(e)}", logging.ERROR)
+    return response
+
+@app.teardown_request
+def teardown_request(exc):
+    # Exceptions no route caught end up here (answered with a 500); handled failures are counted where they are caught
+    if exc is not None:
+        metrics.errors.inc(*metric_labels())
+
+@contextmanager
+def timed(stage, stage_times=None):
+    '''Record how long a block takes under the given stage name, in the current request's stage times by default.'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        (g.stage_times if stage_times is None else stage_times)[stage] = time.perf_counter() - start
+
+class UploadError(ValueError):
+    '''The request carries no usable image; answered with a "fail" message.'''
+
+class Upload:
+    '''An uploaded image, kept as the request bytes until inference needs its pixels.
+
+    Raw uploads have a shape and dtype, encoded ones are decoded on first use.
+    A cache hit answers from the bytes alone and never decodes the image.
+    '''
+    def __init__(self, data, shape=None, dtype=None, image=None):
+        self.data = data
+        self.shape = shape
+        self.dtype = dtype
+        self.image = image
+
+    @classmethod
+    def from_image(cls, image):
+        '''Wrap an image that is already decoded (binary protocol).'''
+        image = np.ascontiguousarray(image)
+        return cls(image.data, image.shape, image.dtype, image)
+
+    def decode(self):
+        if self.image is None:
+            if self.shape is not None:
+                image = np.frombuffer(self.data, self.dtype).reshape(self.shape)
+                # The detectors take gray or BGR
+                self.image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR) if image.ndim == 3 and image.shape[2] == 4 else image
+            else:
+                image = cv2.imdecode(np.frombuffer(self.data, np.uint8), cv2.IMREAD_UNCHANGED)
+                if image is None:
+                    raise UploadError('image could not be decoded')
+                self.image = image
+        return self.image
+
+    def preview(self):
+        '''A small gray or color version of the image for the perceptual cache key.'''
+        if self.image is None and self.shape is None:
+            # JPEG decodes straight to 1/8 size from its DCT coefficients, far cheaper than the full decode
+            preview = cv2.imdecode(np.frombuffer(self.data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+            if preview is None:
+                raise UploadError('image could not be decoded')
+            return preview
+        image = self.decode()
+        step = max(1, min(image.shape[:2]) // 64)
+        return np.ascontiguousarray(image[::step, ::step])
+
+def run_inference(m_method, model_id, upload, stage_times=None):
+    '''Run a CLS or DET request and build its response; shared by the HTTP routes and the binary protocol.
+
+    The Upload is only decoded when the result cache has no answer for it.
+    '''
+    if m_method not in ('CLS', 'DET'):
+        return {"message": "no method"}
+    annotations = None
+    if cache is not None:
+        with timed('cache', stage_times):
+            key = cache.key(model_id, upload.data, upload.preview, upload.shape)
+            annotations = cache.get(key)
+    if annotations is None:
+        with timed('decode', stage_times):
+            img = upload.decode()
+        with timed('inference', stage_times):
+            annotations = inference.infer(model_id, img)
+        if cache is not None:
+            cache.put(key, annotations)
+    if archiver is not None:
+        with timed('archive', stage_times):
+            # On a hit the archiver decodes the image itself, and only if this request is sampled
+            archiver.enqueue(m_method, model_id, upload.decode)
+    if m_method == 'CLS':
+        result, score = classify(annotations)
+        return {
+            "message": "success",
+            "result": result,
+            "score": score
+        }
+    return {
+        "message": "success",
+        "annotations": annotations
+    }
+
+def handle_binary(m_method, model_id, img):
+    '''Answer one request from the binary protocol listener, with the same checks and metrics as the HTTP routes.'''
+    start = time.perf_counter()
+    stage_times = {}
+    labels = method_label(m_method, 'BIN '), model_label(model_id)
+    if not inference.is_known(model_id):
+        response = {"message": "fail", "result": "unknown model_id"}
+    else:
+        try:
+            response = run_inference(m_method, model_id, Upload.from_image(img), stage_times)
+        except Exception as e:
+            metrics.errors.inc(*labels)
+            log_message(f"Error processing request: {str(e)}", logging.ERROR, model_id=model_id, method=m_method)
+            response = {"message": "Error processing request", "error": str(e)}
+    metrics.record_request(*labels, response["message"], time.perf_counter() - start, stage_times)
     return response
 
 
@@ -48,66 +223,159 @@ def default():
 def get_method(m_method):
     if m_method == 'status':
         return jsonify({"result": "status", "message": "I'm ok"})
+    elif m_method == 'metrics':
+        return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
     else:
         return jsonify({"result": "fail", "message": "wrong request"})
 
+def read_upload():
+    '''Return the uploaded image as an Upload, whichever way the client sent it.
+
+    - multipart/form-data with a 'file' part: encoded image (the original protocol)
+    - image/jpeg, image/png, ...: the encoded image is the request body, no multipart parsing
+    - application/octet-stream with X-Image-Shape (e.g. "480,640,3") and optional
+      X-Image-Dtype (only uint8): raw gray, BGR or BGRA pixels, wrapped without copying or decoding
+
+    Only the request bytes are read here; decoding waits for a cache miss.
+    '''
+    content_type = request.mimetype
+    if content_type == 'application/octet-stream':
+        shape_header = request.headers.get('X-Image-Shape')
+        if not shape_header:
+            raise UploadError('X-Image-Shape header required for raw uploads')
+        try:
+            shape = tuple(int(v) for v in shape_header.split(','))
+            dtype = np.dtype(request.headers.get('X-Image-Dtype', 'uint8'))
+        except (ValueError, TypeError):
+            raise UploadError('invalid X-Image-Shape or X-Image-Dtype header')
+        with timed('upload'):
+            data = request.get_data(cache=False)
+        if dtype != np.uint8:
+            raise UploadError(f'raw uploads must be uint8, not {dtype}')
+        if len(shape) not in (2, 3) or (len(shape) == 3 and shape[2] not in (1, 3, 4)):
+            raise UploadError(f'raw upload shape {shape} is not (height, width) or (height, width, 1, 3 or 4 channels)')
+        if min(shape) <= 0:
+            raise UploadError(f'raw upload shape {shape} has a dimension that is not positive')
+        # math.prod on Python ints can't overflow the way np.prod would on a huge header
+        if not data or math.prod(shape) * dtype.itemsize != len(data):
+            raise UploadError(f'raw upload of {len(data)} bytes does not match shape {shape} and dtype {dtype}')
+        # A single channel is plain gray
+        return Upload(data, shape[:2], dtype) if len(shape) == 3 and shape[2] == 1 else Upload(data, shape, dtype)
+
+    with timed('upload'):
+        if content_type.startswith('image/'):
+            data = request.get_data(cache=False)
+        elif 'file' in request.files:
+            data = request.files['file'].read()
+        else:
+            raise UploadError('no image in request')
+    if not data:
+        # cv2.imdecode raises instead of returning None on an empty buffer
+        raise UploadError('empty image')
+    return Upload(data)
+
 @app.route('/api/<string:m_method>', methods=['POST'])
 def post_method(m_method):
     model_id = request.args.get('model_id')
 
     if not model_id:
-        log_message('model_id is not set')
+        log_message('model_id is not set', logging.WARNING, sampled=True)
         return jsonify({"message": "fail", "result": "model_id required"})
     else:
-        log_message('Model_ID : '+model_id)
+        log_message('Model_ID : '+model_id, logging.DEBUG, sampled=True)
+
+    if not inference.is_known(model_id):
+        log_message(f'Unknown model_id : {model_id}', logging.WARNING, sampled=True)
+        return jsonify({"message": "fail", "result": "unknown model_id"})
 
-    # Dummy processing, replace with real image processing using CV2
-    img = cv2.imdecode(np.frombuffer(request.files['file'].read(), np.uint8), cv2.IMREAD_UNCHANGED)
-    Folder_Name = "Output"
     try:
-        # Placeholder logic, replace with actual model inference
-        if m_method == 'CLS':
-            Folder_Name = Folder_Name+"/CLS"
-            if not os.path.exists(Folder_Name):
-                os.makedirs(Folder_Name)
-                print(f"Folder '{Folder_Name}' created.")
-            else:
-                print(f"Folder '{Folder_Name}' already exists.")
-            cv2.imwrite("Output/CLS/output_image.png", img)
-            return jsonify({
-                "message": "success",
-                "result": "NG",
-                "score": 0.987
-            })
-        elif m_method == 'DET':
-            Folder_Name = Folder_Name+"/DET"
-            if not os.path.exists(Folder_Name):
-                os.makedirs(Folder_Name)
-                print(f"Folder '{Folder_Name}' created.")
-            else:
-                print(f"Folder '{Folder_Name}' already exists.")
-            cv2.imwrite("Output/DET/output_image.png", img)
-            return jsonify({
-                "message": "success",
-                "annotations": [
-                    {"box_cx": 150, "box_cy": 150, "box_w": 100, "box_h": 100, "label": "apple", "score": 0.964, "rotation": -45},
-                    {"box_cx": 550, "box_cy": 550, "box_w": 100, "box_h": 100, "label": "car", "score": 1.000, "rotation": 0},
-                    {"box_cx": 350, "box_cy": 350, "box_w": 150, "box_h": 150, "label": "mobilephone", "score": 0.886, "rotation": 135}
-                ]
-            })
-        else:
-            return jsonify({"message": "no method"})
+        response = run_inference(m_method, model_id, read_upload())
+        with timed('serialize'):
+            return jsonify(response)
+    except UploadError as e:
+        log_message(f'Bad upload : {str(e)}', logging.WARNING, sampled=True)
+        return jsonify({"message": "fail", "result": str(e)})
     except Exception as e:
-        log_message(f"Error processing request: {str(e)}")
+        metrics.errors.inc(*metric_labels())
+        log_message(f"Error processing request: {str(e)}", logging.ERROR, model_id=model_id, method=m_method)
         return jsonify({"message": "Error processing request", "error": str(e)})
 
 # Entry point
-if __name__ == '__main__':
+def cli(argv=None):
+    global logger, SERVER_TIMING, archiver, registry, inference, cache
+    parser = argparse.ArgumentParser(description='TM Vision HTTP Server')
+    parser.add_argument('--port', type=int, default=HOST_PORT, help='Port to listen on')
+    parser.add_argument('--preload', default='',
+                        help=f"Comma separated model_ids to load at startup, or 'all' ({', '.join(MODEL_LOADERS)}). Others load on first request")
+    parser.add_argument('--batch-window-ms', type=float, default=0,
+                        help='Gather concurrent requests for the same model_id for up to this long and run them as one batch (0 disables)')
+    parser.add_argument('--max-batch', type=int, default=8, help='Largest micro-batch when batching is enabled')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Run inference in this many worker processes, each with its own warm models (0 runs in-process)')
+    parser.add_argument('--pin-cores', default='',
+                        help='Comma separated CPU cores to pin worker processes to, one core per worker (Linux only)')
+    parser.add_argument('--archive-dir', default='Output', help='Folder request images are archived to')
+    parser.add_argument('--archive-format', default='png', choices=['png', 'jpg'], help='Image format of archived requests')
+    parser.add_argument('--archive-quality', type=int, default=90, help='JPEG quality of archived requests')
+    parser.add_argument('--archive-every', type=int, default=1, help='Archive every Nth request (0 disables archiving)')
+    parser.add_argument('--archive-queue', type=int, default=32, help='Images waiting to be written before the oldest is dropped')
+    parser.add_argument('--binary-port', type=int, default=0,
+                        help=f'Also answer CLS/DET over the length-prefixed TCP protocol on this port, e.g. {BINARY_PORT} (0 disables)')
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help='Keep the results of this many recent frames and answer repeats from them (0 disables)')
+    parser.add_argument('--cache-ttl', type=float, default=10.0, help='Seconds a cached result stays valid')
+    parser.add_argument('--cache-tolerance', type=int, default=-1,
+                        help='Match frames by perceptual hash, allowing this many differing bits of 256 (-1 only matches identical pixels)')
+    parser.add_argument('--backend', default='default', choices=BACKENDS,
+                        help='Run the emotion and OCR recognition networks with their own framework or with ONNX Runtime (optionally int8)')
+    parser.add_argument('--intra-threads', type=int, default=0,
+                        help='ONNX Runtime threads per operator (0 picks one per core; use 1 with several --workers)')
+    parser.add_argument('--inter-threads', type=int, default=0, help='ONNX Runtime threads running independent operators')
+    parser.add_argument('--onnx-dir', default=MODEL_DIR, help='Where exported ONNX models are cached')
+    parser.add_argument('--server-timing', action='store_true', help='Add per-stage durations as a Server-Timing response header')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Lowest level written to the log')
+    parser.add_argument('--log-format', default='json', choices=['json', 'text'], help='JSON records or the plain [timestamp] message lines')
+    parser.add_argument('--log-max-per-second', type=int, default=50,
+                        help='Per-request log lines written per second before sampling starts (0 never samples)')
+    parser.add_argument('--log-sample-every', type=int, default=10, help='Above the limit, keep one in this many per-request lines (0 drops them all)')
+    args = parser.parse_args(argv)
+
+    logger = setup_logging(level=args.log_level, log_format=args.log_format,
+                           max_per_second=args.log_max_per_second, sample_every=args.log_sample_every)
+    SERVER_TIMING = args.server_timing
+
+    archiver = ResultArchiver(args.archive_dir, args.archive_format, args.archive_quality, args.archive_every, args.archive_queue)
+
+    if args.cache_size > 0:
+        cache = ResultCache(args.cache_size, args.cache_ttl, args.cache_tolerance if args.cache_tolerance >= 0 else None)
+
+    backend = backend_options(args)
+    preload = list(MODEL_LOADERS) if args.preload == 'all' else [m for m in args.preload.split(',') if m]
+    if args.workers > 0:
+        pin_cores = [int(c) for c in args.pin_cores.split(',') if c]
+        log_message(f'Starting {args.workers} inference workers')
+        registry = None
+        inference = WorkerPool(args.workers, preload, pin_cores, backend)
+    else:
+        registry = inference = ModelRegistry(backend_loaders(backend))
+        for model_id in preload:
+            log_message(f'Loading model {model_id}')
+            registry.preload([model_id])
+
+    if args.batch_window_ms > 0:
+        inference = InferenceScheduler(inference, args.batch_window_ms, args.max_batch)
+        log_message(f'Micro-batching enabled: window {args.batch_window_ms} ms, max {args.max_batch} images')
+
     try:
         host_ip = socket.gethostbyname(socket.gethostname())
     except Exception as e:
         log_message(str(e))
         host_ip = "127.0.0.1"
-    log_message(f'serving on http://{host_ip}:{HOST_PORT}')
-    serve(app, host=host_ip, port=HOST_PORT, ident=HOST_NAME)
+    if args.binary_port:
+        BinaryServer((host_ip, args.binary_port), handle_binary, log=log_message).start()
+        log_message(f'binary protocol on {host_ip}:{args.binary_port}')
+    log_message(f'serving on http://{host_ip}:{args.port}')
+    serve(app, host=host_ip, port=args.port, ident=HOST_NAME)
 
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,119 @@
+import threading
+import queue
+
+# Marks the end of the stream on the stage queues
+END_OF_STREAM = object()
+
+
+def is_live_source(source):
+    """Camera indices and network streams are live; files can be read at whatever pace we need."""
+    if source is None or isinstance(source, int):
+        return True
+    source = str(source)
+    return source.isdigit() or source.split('://')[0].lower() in ('rtsp', 'rtmp', 'http', 'https', 'udp', 'tcp')
+
+
+class FramePipeline:
+    """Runs capture, inference and the caller's sink stage concurrently.
+
+    A capture thread reads frames from the cv2.VideoCapture, an inference
+    thread runs process(frame) on them, and the caller iterates over the
+    pipeline to get (frame, result) pairs for display or encoding. Stages are
+    joined by bounded queues. For live sources the capture queue keeps only
+    the newest frames (latest frame wins) so inference never works on stale
+    images; for files every frame is processed.
+
+        with FramePipeline(cap, self.process_frame, live) as pipeline:
+            for frame, result in pipeline:
+                ...
+    """
+    def __init__(self, cap, process, live=False, queue_size=2):
+        self.cap = cap
+        self.process = process
+        self.live = live
+        self.captured = queue.Queue(maxsize=queue_size)
+        self.processed = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.dropped = 0
+        self.error = None
+        self.threads = [
+            threading.Thread(target=self.capture_stage, name='capture', daemon=True),
+            threading.Thread(target=self.inference_stage, name='inference', daemon=True),
+        ]
+
+    def __enter__(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def __iter__(self):
+        while True:
+            item = self.get(self.processed)
+            if item is END_OF_STREAM:
+                break
+            yield item
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        """Stop the stages; the capture is no longer being read when this returns, so the caller may release it."""
+        self.stopped.set()
+        capture, inference = self.threads
+        # No timeout: a slow RTSP or USB read can take longer than any fixed wait, and releasing the capture
+        # while cap.read() is still running crashes some OpenCV backends
+        capture.join()
+        inference.join(timeout=1.0)
+
+    def put(self, stage_queue, item, drop_oldest=False):
+        """Put that gives up when the pipeline is stopped, optionally replacing the oldest queued item."""
+        while not self.stopped.is_set():
+            try:
+                if drop_oldest:
+                    # Latest frame wins: make room at once instead of waiting for inference to catch up
+                    stage_queue.put_nowait(item)
+                else:
+                    stage_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if drop_oldest:
+                    try:
+                        stage_queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        return False
+
+    def get(self, stage_queue):
+        while not self.stopped.is_set():
+            try:
+                return stage_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return END_OF_STREAM
+
+    def capture_stage(self):
+        while not self.stopped.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            if not self.put(self.captured, frame, drop_oldest=self.live):
+                return
+        self.put(self.captured, END_OF_STREAM)
+
+    def inference_stage(self):
+        while True:
+            frame = self.get(self.captured)
+            if frame is END_OF_STREAM:
+                break
+            try:
+                result = self.process(frame)
+            except Exception as e:
+                self.error = e
+                break
+            if not self.put(self.processed, (frame, result)):
+                return
+        self.put(self.processed, END_OF_STREAM)
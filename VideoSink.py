@@ -0,0 +1,171 @@
+import os
+import queue
+import subprocess
+import threading
+import cv2
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov')
+# Container extension -> OpenCV fourcc used when no codec is given
+DEFAULT_CODECS = {'.mp4': 'mp4v', '.avi': 'XVID', '.mkv': 'XVID', '.mov': 'mp4v'}
+
+# Marks the end of the stream on the writer queue
+END_OF_STREAM = object()
+
+
+def is_video_path(path):
+    return bool(path) and os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+class AsyncVideoWriter:
+    """Encodes frames on its own thread so encoding never holds up capture or inference.
+
+    write() only queues the frame. With drop_when_full (for live sources) a
+    full queue drops the oldest frame instead of waiting. segment_seconds
+    starts a new numbered file (name_000.mp4, name_001.mp4, ...) every that
+    many seconds of video. encoder='ffmpeg' pipes raw frames to an ffmpeg
+    process instead of cv2.VideoWriter, for codecs OpenCV wasn't built with;
+    there codec is an ffmpeg encoder name (default libx264) and quality its CRF.
+    For OpenCV quality is VIDEOWRITER_PROP_QUALITY (0-100, MJPG only).
+    """
+    def __init__(self, path, fps, size=None, codec=None, quality=None, segment_seconds=0, encoder='opencv',
+                 max_queue=32, drop_when_full=False):
+        self.path = path
+        self.fps = fps if fps and fps > 0 else 30.0
+        self.size = size
+        self.codec = codec
+        self.quality = quality
+        self.segment_frames = int(segment_seconds * self.fps) if segment_seconds else 0
+        self.encoder = encoder
+        self.drop_when_full = drop_when_full
+        self.frames = queue.Queue(maxsize=max_queue)
+        self.writer = None
+        self.segment = 0
+        self.segment_written = 0
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='video-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        if self.drop_when_full:
+            while True:
+                try:
+                    self.frames.put_nowait(frame)
+                    return
+                except queue.Full:
+                    try:
+                        self.frames.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        self.frames.put(frame)
+
+    def close(self):
+        self.frames.put(END_OF_STREAM)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def segment_path(self):
+        if not self.segment_frames:
+            return self.path
+        base, ext = os.path.splitext(self.path)
+        return f'{base}_{self.segment:03d}{ext}'
+
+    def open(self, size):
+        path = self.segment_path()
+        width, height = size
+        if self.encoder == 'ffmpeg':
+            command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+                       '-s', f'{width}x{height}', '-r', str(self.fps), '-i', '-',
+                       '-c:v', self.codec or 'libx264', '-pix_fmt', 'yuv420p']
+            if self.quality is not None:
+                command += ['-crf', str(self.quality)]
+            return subprocess.Popen(command + [path], stdin=subprocess.PIPE)
+        codec = self.codec or DEFAULT_CODECS.get(os.path.splitext(path)[1].lower(), 'mp4v')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), self.fps, (width, height))
+        if not writer.isOpened():
+            raise IOError(f'cannot open {path} for writing with codec {codec}')
+        if self.quality is not None:
+            writer.set(cv2.VIDEOWRITER_PROP_QUALITY, self.quality)
+        return writer
+
+    def release(self):
+        if self.writer is None:
+            return
+        writer, self.writer = self.writer, None
+        if self.encoder == 'ffmpeg':
+            try:
+                writer.stdin.close()
+            except BrokenPipeError:
+                # ffmpeg already exited, its exit code below says why
+                pass
+            if writer.wait() != 0:
+                raise IOError(f'ffmpeg exited with code {writer.returncode} writing {self.segment_path()}')
+        else:
+            writer.release()
+
+    def run(self):
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is END_OF_STREAM:
+                    break
+                if self.error is not None:
+                    # Keep draining so write() never blocks after a failure
+                    continue
+                size = (frame.shape[1], frame.shape[0])
+                if self.size is None:
+                    self.size = size
+                if self.segment_frames and self.segment_written >= self.segment_frames:
+                    self.release()
+                    self.segment += 1
+                    self.segment_written = 0
+                if self.writer is None:
+                    self.writer = self.open(self.size)
+                if size != self.size:
+                    frame = cv2.resize(frame, self.size)
+                if frame.ndim == 2:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+                if self.encoder == 'ffmpeg':
+                    self.writer.stdin.write(frame.tobytes())
+                else:
+                    self.writer.write(frame)
+                self.segment_written += 1
+                self.written += 1
+        except Exception as e:
+            self.error = e
+            while self.frames.get() is not END_OF_STREAM:
+                pass
+        finally:
+            try:
+                self.release()
+            except IOError as e:
+                # A failed ffmpeg shows up as a broken pipe first, its exit code is the more useful error
+                if self.error is None or isinstance(self.error, BrokenPipeError):
+                    self.error = e
+
+
+def add_video_arguments(parser):
+    """Options of the annotated video output, shared by the detector scripts."""
+    parser.add_argument('--codec', help='FourCC for OpenCV (default from the file extension) or ffmpeg encoder name')
+    parser.add_argument('--quality', type=int, help='Encoder quality: 0-100 for OpenCV MJPG, CRF for ffmpeg')
+    parser.add_argument('--segment_seconds', type=float, default=0, help='Start a new numbered video file every N seconds (0 writes one file)')
+    parser.add_argument('--ffmpeg', action='store_true', help='Encode by piping frames to an ffmpeg process')
+
+
+def open_video_writer(path, cap, live=False, args=None):
+    """AsyncVideoWriter matching the capture's frame rate and size, configured from add_video_arguments options."""
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    return AsyncVideoWriter(path, cap.get(cv2.CAP_PROP_FPS), size if all(size) else None,
+                            codec=getattr(args, 'codec', None), quality=getattr(args, 'quality', None),
+                            segment_seconds=getattr(args, 'segment_seconds', 0),
+                            encoder='ffmpeg' if getattr(args, 'ffmpeg', False) else 'opencv', drop_when_full=live)
@@ -0,0 +1,104 @@
+import os
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait
+import numpy as np
+
+# Registry owned by this worker process, created once by init_worker
+worker_registry = None
+
+
+def init_worker(preload, pin_cores, next_core, started, backend=None):
+    global worker_registry
+    try:
+        if pin_cores and hasattr(os, 'sched_setaffinity'):
+            # Hand out cores in start order so each worker keeps its own cache and model threads
+            with next_core.get_lock():
+                core = pin_cores[next_core.value % len(pin_cores)]
+                next_core.value += 1
+            os.sched_setaffinity(0, {core})
+        from ModelRegistry import ModelRegistry, backend_loaders
+        worker_registry = ModelRegistry(backend_loaders(backend))
+        worker_registry.preload(preload)
+    finally:
+        # Also passed on failure, the pool then reports itself broken on the first request instead of hanging here
+        started.wait()
+
+
+def run_shared(model_id, shm_name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        annotations = worker_registry.infer(model_id, image)
+        del image
+        return annotations
+    finally:
+        shm.close()
+
+
+class SharedFrame:
+    """Copies one frame into a shared memory block the workers can map without pickling it."""
+    def __init__(self, image):
+        self.shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+        self.shape = image.shape
+        self.dtype = image.dtype.str
+        np.ndarray(image.shape, dtype=image.dtype, buffer=self.shm.buf)[...] = image
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class WorkerPool:
+    """Runs inference in a pool of processes, each holding its own warm ModelRegistry.
+
+    Frames travel through shared memory; only the model_id, block name and
+    shape are pickled, and only the small annotation lists come back.
+    Raises RuntimeError when the workers are not ready within start_timeout seconds.
+    """
+    def __init__(self, num_workers, preload=(), pin_cores=None, backend=None, start_timeout=300.0):
+        from ModelRegistry import MODEL_LOADERS
+        self.known = set(MODEL_LOADERS)
+        # spawn, because forking a process that already runs waitress threads is not safe
+        context = multiprocessing.get_context('spawn')
+        # Every worker's initializer and this constructor meet here once all models are preloaded
+        started = context.Barrier(num_workers + 1)
+        self.executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=context,
+                                            initializer=init_worker,
+                                            initargs=(list(preload), list(pin_cores or []), context.Value('i', 0), started, backend))
+        # Every submit without an idle worker spawns one, so this starts the whole pool; the probes themselves
+        # can't show that every worker is ready (one worker may run them all), the barrier does
+        probes = [self.executor.submit(os.getpid) for _ in range(num_workers)]
+        try:
+            started.wait(start_timeout)
+        except threading.BrokenBarrierError:
+            # A worker that died before reaching the barrier (crash, killed) never arrives
+            started.abort()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            raise RuntimeError(f'worker failed to start within {start_timeout:g} s') from None
+        wait(probes)
+
+    def is_known(self, model_id):
+        return model_id in self.known
+
+    def submit(self, model_id, image):
+        frame = SharedFrame(image)
+        try:
+            future = self.executor.submit(run_shared, model_id, frame.shm.name, frame.shape, frame.dtype)
+        except Exception:
+            # A broken pool refuses the job, the block would otherwise never be unlinked
+            frame.release()
+            raise
+        future.add_done_callback(lambda _: frame.release())
+        return future
+
+    def infer(self, model_id, image):
+        return self.submit(model_id, image).result()
+
+    def infer_batch(self, model_id, images):
+        futures = [self.submit(model_id, image) for image in images]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        self.executor.shutdown()
@@ -0,0 +1,82 @@
+import argparse
+import importlib
+import subprocess
+import sys
+import os
+
+# Subcommand -> (module, entry function taking argv, heavy backend the module imports on first use)
+COMMANDS = {
+    'gesture': ('GestureRecognition', 'cli', 'mediapipe'),
+    'fingers': ('FingerCounter', 'cli', 'mediapipe'),
+    'handraise': ('HandRaiseDetection', 'cli', 'mediapipe'),
+    'rps': ('Rock_Paper_Scissors', 'cli', 'mediapipe'),
+    'emotion': ('FaceEmotion', 'cli', 'fer'),
+    'ocr': ('OCR_Detection', 'cli', 'easyocr'),
+    'qr': ('QR_Code', 'cli', 'pyzbar.pyzbar'),
+    'multicam': ('MultiCamera', 'cli', None),
+    'onnx': ('OnnxBackend', 'cli', 'onnxruntime'),
+    'server': ('TMvision_HTTP_server', 'cli', None),
+    'benchmark': ('Benchmark', 'main', None),
+}
+
+# Run in a fresh interpreter per command so every measurement is a cold import
+IMPORT_PROBE = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+module_s = time.perf_counter() - start
+backend = {backend!r}
+backend_s = None
+if backend:
+    start = time.perf_counter()
+    try:
+        __import__(backend)
+        backend_s = time.perf_counter() - start
+    except ImportError:
+        backend_s = -1.0
+print(module_s, backend_s)
+'''
+
+
+def import_report(commands):
+    """Print the cold import time of each command's module and of the backend it loads on first use."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    print(f'{"command":>10} {"module":>10} {"backend":>24}')
+    for command in commands:
+        module, _, backend = COMMANDS[command]
+        probe = subprocess.run([sys.executable, '-c', IMPORT_PROBE.format(module=module, backend=backend)],
+                               capture_output=True, text=True, cwd=here)
+        if probe.returncode != 0:
+            print(f'{command:>10} {"failed":>10}  {probe.stderr.strip().splitlines()[-1]}')
+            continue
+        module_s, backend_s = probe.stdout.split()[-2:]
+        if backend_s == 'None':
+            backend_text = '-'
+        elif float(backend_s) < 0:
+            backend_text = f'{backend} not installed'
+        else:
+            backend_text = f'{backend} {float(backend_s) * 1000.0:.0f} ms'
+        print(f'{command:>10} {float(module_s) * 1000.0:>7.0f} ms {backend_text:>24}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='TM vision tools. Only the chosen tool is imported, and its backend only when a model is built.',
+        usage='tmvision.py {' + ','.join(list(COMMANDS) + ['imports']) + '} [options]')
+    parser.add_argument('command', choices=list(COMMANDS) + ['imports'],
+                        help="Tool to run; 'imports' reports the import time of the given tools (all by default)")
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="The tool's own options, see tmvision.py <command> -h")
+    args = parser.parse_args(argv)
+
+    if args.command == 'imports':
+        unknown = [c for c in args.args if c not in COMMANDS]
+        if unknown:
+            parser.error(f'unknown commands: {", ".join(unknown)}')
+        import_report(args.args or list(COMMANDS))
+        return
+    module, function, _ = COMMANDS[args.command]
+    return getattr(importlib.import_module(module), function)(args.args)
+
+
+if __name__ == "__main__":
+    main()